@@ -22,12 +22,20 @@ layouts = [
     'strategicCapture',
 ]
 NUM_GAMES = 3  # The number of repeated games to play on each layout
+# Winning rates that decide something (run_tournament.py qualifies the teams
+# that win at least half of their games against baselineTeam).  With early
+# stopping, the games against these agents stop once the rate is decided, and
+# the skipped games are reported and left out of the scores and rates.
+WIN_RATE_THRESHOLDS = {
+    'baselineTeam': 0.5,
+}
 
 
-def main(student_agent):
+def main(student_agent, early_stop=False):
     results = {}
     leaderboard = []
     output_str = ''
+    skipped_games = []
 
     final_score = 0.
     final_num_won = 0
@@ -36,8 +44,25 @@ def main(student_agent):
         score = 0.
         num_won = 0
         num_played = 0
+        num_skipped = 0
         repeated_layouts = [(l, n) for l in layouts for n in range(NUM_GAMES)]
-        for layout, n_game in repeated_layouts:
+        threshold = WIN_RATE_THRESHOLDS.get(staff_agent_name)
+        for i_game, (layout, n_game) in enumerate(repeated_layouts):
+            num_left = len(repeated_layouts) - i_game
+            if early_stop and threshold is not None and (
+                    num_won >= threshold * len(repeated_layouts) or
+                    num_won + num_left < threshold * len(repeated_layouts)):
+                # The winning rate is on the same side of the threshold
+                # whatever the remaining games do; they are left out of it
+                for skipped_layout, skipped_game in repeated_layouts[i_game:]:
+                    skipped_games.append({
+                        'opponent': staff_agent_name, 'layout': skipped_layout,
+                        'game': skipped_game+1})
+                num_skipped = num_left
+                print('Skipping the last {} games against {}: the winning '
+                      'rate threshold of {} is decided.'.format(
+                          num_left, staff_agent_name, threshold))
+                break
             if n_game == 0:
                 print('##########################################################')  # NoQA
             print('Playing against {} on {} - game {} / {}.'.format(
@@ -76,6 +101,10 @@ def main(student_agent):
             if n_game == NUM_GAMES - 1:
                 print('##########################################################')  # NoQA
 
+        if num_skipped:
+            # The score is the average of the games played, on the same
+            # scale as if all of them had been
+            score = score * len(repeated_layouts) / num_played
         final_score += score
         final_num_won += num_won
         final_num_played += num_played
@@ -88,6 +117,12 @@ def main(student_agent):
             'value': round(win_rate,3)})
         output_str += 'myTeam vs. %s: Score: %f, Winning Rate: %.3f\n' % (
             staff_agent_name, score, win_rate)
+        if num_skipped:
+            output_str += ('  (%d of %d games played: the rest were skipped '
+                           'once the winning rate threshold of %.2f was '
+                           'decided, and the score and rate are over the '
+                           'games played)\n' % (
+                               num_played, len(repeated_layouts), threshold))
 
     final_win_rate = final_num_won / final_num_played
     leaderboard.append({
@@ -105,6 +140,8 @@ def main(student_agent):
     score_fields['score'] = final_score
     score_fields['leaderboard'] = leaderboard
     score_fields['output'] = output_str
+    if early_stop:
+        score_fields['extra_data'] = {'skipped_games': skipped_games}
     write_output(score_fields)
 
 
@@ -116,5 +153,8 @@ def write_output(score_fields):
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--pacman', default='myTeam.py')
+    parser.add_argument('--early-stop', action='store_true',
+                        help='stop playing an opponent once the winning rate '
+                             'threshold against it is decided')
     args = parser.parse_args()
-    main(args.pacman)
+    main(args.pacman, args.early_stop)
@@ -22,14 +22,54 @@ distancer.getDistance( (1,1), (10,10) )
 """
 
 import sys, time, random
+import os, hashlib, mmap, tempfile
+from array import array
+from collections import deque, OrderedDict
+import heapq
+from game import Directions
+
+try:
+  import numpy
+  _NUMPY_ENABLED = True
+except:
+  _NUMPY_ENABLED = False
+
+try:
+  from multiprocessing import shared_memory
+  _SHARED_MEMORY_ENABLED = True
+except:
+  _SHARED_MEMORY_ENABLED = False
+
+# Distancer modes: compute all the distances up front, compute the distances
+# from a cell the first time they are needed, do that but compute the
+# distances from a given set of cells up front, or only compute the distances
+# between the junctions of the maze (see JunctionGraph)
+EAGER = 'eager'
+LAZY = 'lazy'
+HYBRID = 'hybrid'
+JUNCTION = 'junction'
+LAZY_CACHE_BYTES = 32 * 1024 * 1024
 
 class Distancer:
-  def __init__(self, layout, default = 10000):
+  def __init__(self, layout, default = 10000, mode = EAGER, maxBytes = LAZY_CACHE_BYTES, eagerCells = ()):
     """
     Initialize with Distancer(layout).  Changing default is unnecessary.
+
+    In LAZY and HYBRID mode the distances from a cell are worked out the first
+    time they are asked for and at most maxBytes of them are kept, dropping the
+    least recently used ones.  HYBRID mode computes (and keeps) the distances
+    from eagerCells up front.  JUNCTION mode answers from the distances between
+    the junctions of the maze, which is much smaller on mazes with long
+    corridors.  Tables that are already computed, in this process, in shared
+    memory or on disk, are used in every mode.
     """
+    if mode not in (EAGER, LAZY, HYBRID, JUNCTION):
+      raise Exception("Unknown distancer mode: " + str(mode))
     self._distances = None
     self.default = default
+    self.mode = mode
+    self.maxBytes = maxBytes
+    self.eagerCells = eagerCells if mode == HYBRID else ()
     self.dc = DistanceCalculator(layout, self, default)
 
   def getMazeDistances(self):
@@ -55,11 +95,130 @@ class Distancer:
     return bestDistance
 
   def getDistanceOnGrid(self, pos1, pos2):
-    key = (pos1, pos2)
-    if key in self._distances:
-      return self._distances[key]
-    else:
-      raise Exception("Positions not in grid: " + str(key))
+    return self._distances.getDistance(pos1, pos2)
+
+  def distancesFrom(self, pos, targets):
+    """
+    Returns the distances from pos to each of targets, as a NumPy array (a
+    list without NumPy), e.g. distancer.distancesFrom(myPos, foodList).min()
+    """
+    targets = list(targets)
+    if self._usesMatrix():
+      try:
+        return self._distances.distanceMatrix([pos], targets)[0]
+      except KeyError:
+        pass # Not all grid points; snap them one by one below
+    distances = [self.getDistance(pos, target) for target in targets]
+    if _NUMPY_ENABLED:
+      return numpy.array(distances)
+    return distances
+
+  def nearest(self, pos, targets):
+    """
+    Returns (target, distance) for the target closest to pos, the first one
+    listed if several are, or None if there are no targets.
+    """
+    targets = list(targets)
+    if not targets:
+      return None
+    distances = self.distancesFrom(pos, targets)
+    if _NUMPY_ENABLED:
+      i = int(numpy.argmin(distances))
+      return targets[i], distances[i].item()
+    i = distances.index(min(distances))
+    return targets[i], distances[i]
+
+  def minDistanceMatrix(self, sources, targets):
+    """
+    Returns the len(sources) x len(targets) array of shortest distances from
+    each source to each target (a list of lists without NumPy).  For instance
+    minDistanceMatrix(myTeamPositions, foodList).min(axis = 0) is how close
+    each food is to the nearest teammate.
+    """
+    sources, targets = list(sources), list(targets)
+    if self._usesMatrix():
+      try:
+        return self._distances.distanceMatrix(sources, targets)
+      except KeyError:
+        pass
+    distances = [[self.getDistance(source, target) for target in targets] for source in sources]
+    if _NUMPY_ENABLED:
+      return numpy.array(distances).reshape(len(sources), len(targets))
+    return distances
+
+  def nextStep(self, pos, target):
+    """
+    Returns an action that starts a shortest path from pos to target (the first
+    in North, South, East, West order), Directions.STOP if pos is target and
+    None if target cannot be reached.  Both must be grid points.  The routing
+    table behind this is built on the first call (see DistanceTable.buildRoutes).
+    """
+    moves = self.allShortestFirstMoves(pos, target)
+    if moves:
+      return moves[0]
+    if pos == target:
+      return Directions.STOP
+    return None
+
+  def allShortestFirstMoves(self, pos, target):
+    """
+    Returns every action from pos that starts a shortest path to target.
+    """
+    table = self._routingTable()
+    return list(ROUTE_MOVES[table.firstMoves(pos, target)])
+
+  def getPath(self, pos, target):
+    """
+    Returns the cells of a shortest path from pos to target, both included, or
+    None if target cannot be reached.
+    """
+    table = self._routingTable()
+    path = [pos]
+    while pos != target:
+      mask = table.firstMoves(pos, target)
+      if not mask:
+        return None
+      direction, (dx, dy) = ROUTE_DIRECTIONS[(mask & -mask).bit_length() - 1]
+      pos = (pos[0] + dx, pos[1] + dy)
+      path.append(pos)
+    return path
+
+  def getJunctionGraph(self):
+    """
+    Returns the JunctionGraph of the layout: its junctions and dead ends, and
+    the corridors between them.
+    """
+    return junctionGraph(self.dc.layout)
+
+  def getDistanceToHome(self, pos, isRed):
+    """
+    Returns the maze distance from pos to the nearest open cell of the red
+    (isRed) or blue team's side of the border, read from a field computed once
+    per layout (see HomeBoundaryField).
+    """
+    field = homeBoundaryField(self.dc.layout)
+    if pos in field.cellIds:
+      return field.getDistance(pos, isRed)
+    return self.nearest(pos, field.boundary[isRed])[1]
+
+  def getNearestHomeCell(self, pos, isRed):
+    """
+    Returns a border cell of the red (isRed) or blue team's side that is
+    closest to pos, or None if none can be reached.
+    """
+    field = homeBoundaryField(self.dc.layout)
+    if pos in field.cellIds:
+      return field.getNearestCell(pos, isRed)
+    return self.nearest(pos, field.boundary[isRed])[0]
+
+  def _routingTable(self):
+    if self._distances == None:
+      raise Exception("Maze distances have not been computed; call getMazeDistances() first")
+    self._distances.buildRoutes()
+    return self._distances
+
+  def _usesMatrix(self):
+    return self._distances != None and self._distances.vectorized
 
   def isReadyForMazeDistance(self):
     return self._distances != None
@@ -89,6 +248,9 @@ def getGrids1D(x):
 ##########################################
 
 distanceMap = {}
+lazyDistanceMap = {}
+junctionGraphMap = {}
+homeBoundaryMap = {}
 
 class DistanceCalculator:
   def __init__(self, layout, distancer, default = 10000):
@@ -100,52 +262,678 @@ class DistanceCalculator:
     global distanceMap
 
     if self.layout.walls not in distanceMap:
-      distances = computeDistances(self.layout)
+      distances = attachSharedDistances(self.layout)
+      if distances is None:
+        distances = loadDistances(self.layout)
+      if distances is None and self.distancer.mode != EAGER:
+        self.distancer._distances = self.runLazy()
+        return
+      if distances is None:
+        distances = computeDistances(self.layout)
+        saveDistances(self.layout, distances)
       distanceMap[self.layout.walls] = distances
     else:
       distances = distanceMap[self.layout.walls]
 
     self.distancer._distances = distances
 
+  def runLazy(self):
+    "The lazy (or junction) table for the layout, shared by the distancers in this process"
+    if self.distancer.mode == JUNCTION:
+      return junctionGraph(self.layout).distanceTable()
+    walls = self.layout.walls
+    if walls not in lazyDistanceMap:
+      lazyDistanceMap[walls] = LazyDistanceTable(self.layout, self.distancer.maxBytes)
+    table = lazyDistanceMap[walls]
+    table.maxBytes = max(table.maxBytes, self.distancer.maxBytes)
+    table.pin(self.distancer.eagerCells)
+    return table
+
+# Maze distances can also be cached on disk, keyed by a hash of the walls, so
+# that other processes (tournament workers, later runs) map them in instead of
+# recomputing them.  The cache is off unless PACMAN_DISTANCE_CACHE names its
+# directory (run_tournament.py turns it on in DEFAULT_DISTANCE_CACHE_DIR), and
+# it only holds the layouts loaded from layout files, not generated ones.
+DISTANCE_CACHE_ENV = 'PACMAN_DISTANCE_CACHE'
+DEFAULT_DISTANCE_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'pacmanDistances')
+DISTANCE_CACHE_VERSION = 2
+DISTANCE_CACHE_MAGIC = b'PACDIST\0'
+DISTANCE_CACHE_HEADER = 32 # the magic, the fingerprint's sha1 digest and padding
+
+def wallsFingerprint(walls):
+  "A hash of the wall grid that identifies the distance table of a layout"
+  text = 'v%d %s %s' % (DISTANCE_CACHE_VERSION, sys.byteorder, str(walls))
+  return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def distanceCacheDir():
+  return os.environ.get(DISTANCE_CACHE_ENV) or None
+
+def distanceCachePath(layout):
+  "Where the table of layout is cached, or None if it is not to be"
+  cacheDir = distanceCacheDir()
+  if cacheDir is None or not layout.fromFile:
+    return None
+  return os.path.join(cacheDir, 'v%d-%s.dist' % (DISTANCE_CACHE_VERSION, wallsFingerprint(layout.walls)))
+
+def distanceCacheHeader(layout):
+  digest = bytes.fromhex(wallsFingerprint(layout.walls))
+  return (DISTANCE_CACHE_MAGIC + digest).ljust(DISTANCE_CACHE_HEADER, b'\0')
+
+def loadDistances(layout):
+  """
+  Memory-maps the cached distance table of layout, or returns None if there is
+  none (or it is unusable).  The file holds a header naming the layout's walls
+  and then the raw int16 matrix.
+  """
+  path = distanceCachePath(layout)
+  if path is None or not os.path.exists(path):
+    return None
+  cells, symmetric = tableCells(layout)
+  n, rows = len(cells), numTableRows(len(cells), symmetric)
+  try:
+    if os.path.getsize(path) != DISTANCE_CACHE_HEADER + 2 * rows * n:
+      return None
+    with open(path, 'rb') as f:
+      if f.read(DISTANCE_CACHE_HEADER) != distanceCacheHeader(layout):
+        return None
+      if _NUMPY_ENABLED:
+        matrix = numpy.memmap(f, dtype = numpy.int16, mode = 'r', offset = DISTANCE_CACHE_HEADER, shape = (rows, n))
+      else:
+        matrix = memoryview(mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ))[DISTANCE_CACHE_HEADER:].cast('h')
+  except (OSError, ValueError):
+    return None
+  return DistanceTable(cells, matrix, symmetric)
+
+def saveDistances(layout, distances):
+  """
+  Writes distances to the disk cache, and removes the files an older version
+  of the cache left there.  The file is written under a temporary name and then
+  renamed, so readers never see half of it.  The cache is only an optimization:
+  any error is ignored.
+  """
+  path = distanceCachePath(layout)
+  if path is None:
+    return
+  cacheDir = os.path.dirname(path)
+  tempPath = None
+  try:
+    os.makedirs(cacheDir, exist_ok = True)
+    fd, tempPath = tempfile.mkstemp(dir = cacheDir, suffix = '.tmp')
+    with os.fdopen(fd, 'wb') as f:
+      f.write(distanceCacheHeader(layout))
+      f.write(distances.matrix.tobytes())
+    os.replace(tempPath, path)
+    removeStaleDistances(cacheDir)
+  except OSError:
+    if tempPath is not None and os.path.exists(tempPath):
+      try:
+        os.remove(tempPath)
+      except OSError:
+        pass
+
+def removeStaleDistances(cacheDir):
+  "Deletes the tables in cacheDir written by other versions of the cache"
+  current = 'v%d-' % DISTANCE_CACHE_VERSION
+  for name in os.listdir(cacheDir):
+    if name.endswith('.dist') and not name.startswith(current):
+      try:
+        os.remove(os.path.join(cacheDir, name))
+      except OSError:
+        pass
+
+# A process that runs games in worker processes (see run_tournament.py) can
+# publish the distance tables once in shared memory.  It sets this environment
+# variable to the prefix of the block names, and the workers' Distancers attach
+# to the blocks read-only.
+SHARED_DISTANCES_ENV = 'PACMAN_SHARED_DISTANCES'
+_sharedBlocks = {} # blocks this process attached to, kept open for its lifetime
+
+def sharedDistancesName(layout, prefix):
+  return prefix + wallsFingerprint(layout.walls)[:16]
+
+def publishSharedDistances(layouts, prefix):
+  """
+  Copies the distance tables of layouts into shared memory blocks and returns
+  the blocks; the caller must close() and unlink() them when the workers are
+  done.  Set SHARED_DISTANCES_ENV to prefix before starting the workers.
+  Needs Python 3.8 or newer.
+  """
+  blocks = {}
+  for layout in layouts:
+    name = sharedDistancesName(layout, prefix)
+    if name in blocks:
+      continue
+    distances = loadDistances(layout)
+    if distances is None:
+      distances = computeDistances(layout)
+      saveDistances(layout, distances)
+    data = distances.matrix.tobytes()
+    block = shared_memory.SharedMemory(name = name, create = True, size = len(data))
+    block.buf[:len(data)] = data
+    blocks[name] = block
+  return list(blocks.values())
+
+def attachSharedDistances(layout):
+  """
+  Returns a read-only DistanceTable over the shared memory block published for
+  layout, or None if there is none.
+  """
+  prefix = os.environ.get(SHARED_DISTANCES_ENV)
+  if not prefix or not _SHARED_MEMORY_ENABLED:
+    return None
+  cells, symmetric = tableCells(layout)
+  n, rows = len(cells), numTableRows(len(cells), symmetric)
+  try:
+    block = shared_memory.SharedMemory(name = sharedDistancesName(layout, prefix))
+  except (OSError, ValueError):
+    return None
+  if block.size < 2 * rows * n:
+    block.close()
+    return None
+  _sharedBlocks[block.name] = block
+  if _NUMPY_ENABLED:
+    matrix = numpy.ndarray((rows, n), dtype = numpy.int16, buffer = block.buf)
+    matrix.flags.writeable = False
+  else:
+    matrix = block.buf[:2 * rows * n].cast('h').toreadonly()
+  return DistanceTable(cells, matrix, symmetric)
+
+UNREACHABLE = -1
+
+# The directions of the routing table, in the order Actions lists them
+ROUTE_DIRECTIONS = [(Directions.NORTH, (0, 1)), (Directions.SOUTH, (0, -1)),
+                    (Directions.EAST, (1, 0)), (Directions.WEST, (-1, 0))]
+# The directions in each routing table mask
+ROUTE_MOVES = [[direction for bit, (direction, vector) in enumerate(ROUTE_DIRECTIONS) if mask & (1 << bit)]
+               for mask in range(1 << len(ROUTE_DIRECTIONS))]
+
+def isRotationallySymmetric(walls):
+  "Whether the walls look the same after turning the layout by 180 degrees"
+  width, height = walls.width, walls.height
+  return all(walls[width - 1 - x][height - 1 - y] for x, y in walls.asList())
+
+def tableCells(layout):
+  "The open cells of layout, in id order, and whether the layout is symmetric"
+  return layout.walls.asList(False), isRotationallySymmetric(layout.walls)
+
+def numTableRows(numCells, symmetric):
+  if symmetric:
+    return (numCells + 1) // 2
+  return numCells
+
+class DistanceTable:
+  """
+  The maze distances between all pairs of open cells of a layout.  Each open
+  cell gets an integer id (its index in cells) and the distances are kept in
+  an int16 matrix with a row per source cell, a NumPy array if NumPy is
+  installed and a flat array('h') otherwise.  Pairs of cells that are not
+  connected hold UNREACHABLE.
+
+  Capture layouts are usually the same after turning them by 180 degrees.
+  Cell ids follow walls.asList(False), so turning the layout maps cell i to
+  cell N-1-i, and d(i, j) = d(N-1-i, N-1-j).  For such (symmetric) layouts
+  the matrix only holds the rows of the first half of the cells.
+
+  The table can also be read like the dict computeDistances used to return,
+  e.g. table[(pos1, pos2)].
+  """
+  def __init__(self, cells, matrix, symmetric = False):
+    self.cells = tuple(cells)
+    n = self.numCells = len(self.cells)
+    self.cellIds = dict((cell, i) for i, cell in enumerate(self.cells))
+    self.symmetric = symmetric
+    self.numRows = numTableRows(n, symmetric)
+    # d(pos1, pos2) is flat[start + columns[pos2]] where (start, columns) = rows[pos1]
+    turnedIds = dict((cell, n - 1 - i) for i, cell in enumerate(self.cells))
+    self.rows = {}
+    for i, cell in enumerate(self.cells):
+      if i < self.numRows:
+        self.rows[cell] = (i * n, self.cellIds)
+      else:
+        self.rows[cell] = ((n - 1 - i) * n, turnedIds)
+    self.matrix = matrix
+    if _NUMPY_ENABLED and isinstance(matrix, numpy.ndarray):
+      # Indexing a memoryview gives plain ints, which is much faster than numpy scalars
+      self.flat = memoryview(matrix.reshape(-1))
+    else:
+      self.flat = matrix
+    self.vectorized = _NUMPY_ENABLED and isinstance(matrix, numpy.ndarray)
+    self.routes = None
+
+  def neighborIds(self):
+    """
+    For every cell, the ids of its neighbors in ROUTE_DIRECTIONS order, -1 for walls.
+    """
+    neighbors = []
+    for x, y in self.cells:
+      neighbors.append([self.cellIds.get((x + dx, y + dy), -1) for direction, (dx, dy) in ROUTE_DIRECTIONS])
+    return neighbors
+
+  def fullMatrix(self):
+    "The N x N NumPy matrix, with the turned half filled in for symmetric tables"
+    if not self.symmetric:
+      return self.matrix
+    n, rows = self.numCells, self.numRows
+    full = numpy.empty((n, n), dtype = numpy.int16)
+    full[:rows] = self.matrix
+    full[rows:] = self.matrix[n - 1 - numpy.arange(rows, n)][:, ::-1]
+    return full
+
+  def buildRoutes(self):
+    """
+    Builds the routing table: for every (cell, target) pair a bit mask of the
+    ROUTE_DIRECTIONS that start a shortest path, in an N x N uint8 matrix.
+    Without NumPy the masks are worked out from the distances on each query.
+    """
+    if self.routes is not None or not self.vectorized:
+      return
+    matrix = self.fullMatrix()
+    neighbors = numpy.array(self.neighborIds(), dtype = numpy.intp).reshape(self.numCells, len(ROUTE_DIRECTIONS))
+    routes = numpy.zeros((self.numCells, self.numCells), dtype = numpy.uint8)
+    for bit in range(len(ROUTE_DIRECTIONS)):
+      cells = numpy.nonzero(neighbors[:, bit] >= 0)[0]
+      closer = matrix[neighbors[cells, bit]] == matrix[cells] - 1
+      routes[cells] |= closer.astype(numpy.uint8) << bit
+    self.routes = memoryview(routes.reshape(-1))
+
+  def firstMoves(self, pos, target):
+    """
+    The bit mask of directions that start a shortest path from pos to target.
+    """
+    try:
+      if self.routes is not None:
+        return self.routes[self.cellIds[pos] * self.numCells + self.cellIds[target]]
+      distance = self.getDistance(pos, target)
+    except KeyError:
+      raise Exception("Positions not in grid: " + str((pos, target)))
+    x, y = pos
+    mask = 0
+    for bit, (direction, (dx, dy)) in enumerate(ROUTE_DIRECTIONS):
+      neighbor = (x + dx, y + dy)
+      if neighbor in self.cellIds and self.getDistance(neighbor, target) == distance - 1:
+        mask |= 1 << bit
+    return mask
+
+  def getDistance(self, pos1, pos2):
+    try:
+      start, columns = self.rows[pos1]
+      distance = self.flat[start + columns[pos2]]
+    except KeyError:
+      raise Exception("Positions not in grid: " + str((pos1, pos2)))
+    if distance == UNREACHABLE:
+      return sys.maxsize
+    return distance
+
+  def distanceMatrix(self, sources, targets):
+    """
+    The distances between grid points sources and targets as an int64 array,
+    with UNREACHABLE replaced by sys.maxsize like getDistance does.  Raises
+    KeyError for positions that are not open grid points.  Needs NumPy.
+    """
+    cellIds = self.cellIds
+    rows = numpy.array([cellIds[source] for source in sources], dtype = numpy.intp)
+    columns = numpy.array([cellIds[target] for target in targets], dtype = numpy.intp)
+    if self.symmetric:
+      # Rows of the second half are read from the turned source and targets
+      turned = rows >= self.numRows
+      columns = numpy.where(turned[:, None], self.numCells - 1 - columns[None, :], columns[None, :])
+      rows = numpy.where(turned, self.numCells - 1 - rows, rows)[:, None]
+    else:
+      rows, columns = numpy.ix_(rows, columns)
+    distances = self.matrix[rows, columns].astype(numpy.int64)
+    distances[distances == UNREACHABLE] = sys.maxsize
+    return distances
+
+  def __getitem__(self, key):
+    return self.getDistance(key[0], key[1])
+
+  def __contains__(self, key):
+    return key[0] in self.cellIds and key[1] in self.cellIds
+
+  def __len__(self):
+    return self.numCells * self.numCells
+
+class LazyDistanceTable(DistanceTable):
+  """
+  A DistanceTable that runs a BFS from a cell the first time a distance from
+  (or, as distances are symmetric, to) it is asked for and keeps the row of
+  distances, evicting the least recently used rows beyond maxBytes.  Pinned
+  rows are never evicted and do not count against maxBytes.
+  """
+  def __init__(self, layout, maxBytes = LAZY_CACHE_BYTES):
+    DistanceTable.__init__(self, layout.walls.asList(False), None)
+    self.neighbors = cellNeighbors(self.cells, self.cellIds)
+    self.directedNeighbors = self.neighborIds()
+    self.maxBytes = maxBytes
+    self.vectorized = _NUMPY_ENABLED
+    self.pinned = {}
+    self.cache = OrderedDict()
+
+  def pin(self, cells):
+    for cell in cells:
+      if cell in self.cellIds:
+        source = self.cellIds[cell]
+        if source in self.cache:
+          self.pinned[source] = self.cache.pop(source)
+        elif source not in self.pinned:
+          self.pinned[source] = _breadthFirstRow(self.neighbors, source)
+
+  def row(self, source):
+    "The distances from the cell with id source, computing them if needed"
+    if source in self.pinned:
+      return self.pinned[source]
+    cache = self.cache
+    if source in cache:
+      cache.move_to_end(source)
+      return cache[source]
+    row = _breadthFirstRow(self.neighbors, source)
+    cache[source] = row
+    maxRows = max(1, self.maxBytes // (2 * self.numCells))
+    while len(cache) > maxRows:
+      cache.popitem(last = False)
+    return row
+
+  def getDistance(self, pos1, pos2):
+    try:
+      i, j = self.cellIds[pos1], self.cellIds[pos2]
+    except KeyError:
+      raise Exception("Positions not in grid: " + str((pos1, pos2)))
+    pinned = self.pinned
+    if i in pinned:
+      distance = pinned[i][j]
+    elif j in pinned:
+      distance = pinned[j][i]
+    elif j in self.cache and i not in self.cache:
+      distance = self.row(j)[i]
+    else:
+      distance = self.row(i)[j]
+    if distance == UNREACHABLE:
+      return sys.maxsize
+    return distance
+
+  def distanceMatrix(self, sources, targets):
+    cellIds = self.cellIds
+    rows = [cellIds[source] for source in sources]
+    columns = [cellIds[target] for target in targets]
+    distances = numpy.zeros((len(rows), len(columns)), dtype = numpy.int64)
+    for i, source in enumerate(rows):
+      distances[i] = numpy.frombuffer(self.row(source), dtype = numpy.int16)[columns]
+    distances[distances == UNREACHABLE] = sys.maxsize
+    return distances
+
+  def buildRoutes(self):
+    pass # Routes come from the target's row on each query
+
+  def firstMoves(self, pos, target):
+    try:
+      start, row = self.cellIds[pos], self.row(self.cellIds[target])
+    except KeyError:
+      raise Exception("Positions not in grid: " + str((pos, target)))
+    mask = 0
+    for bit, neighbor in enumerate(self.directedNeighbors[start]):
+      if neighbor >= 0 and row[neighbor] == row[start] - 1:
+        mask |= 1 << bit
+    return mask
+
+def junctionGraph(layout):
+  "The JunctionGraph of layout, built once per wall grid"
+  if layout.walls not in junctionGraphMap:
+    junctionGraphMap[layout.walls] = JunctionGraph(layout)
+  return junctionGraphMap[layout.walls]
+
+class JunctionGraph:
+  """
+  The maze as a weighted graph.  Its nodes are the open cells that do not have
+  exactly two open neighbors (junctions and dead-end tips, plus one cell of
+  every corridor that loops without meeting one).  Its edges are the corridors
+  between them, weighted by their length.
+
+    nodes          the node cells; a node's id is its index
+    nodeIds        {cell: node id}
+    edges          (u, v, length, corridor) per edge, where corridor lists the
+                   cells strictly between nodes u and v, starting next to u
+    cellEdges      {corridor cell: (edge id, steps from u)}
+    adjacency      per node, the (neighbor node, length, edge id) of its edges
+
+  The shortest distances between all pairs of nodes are computed with
+  Dijkstra's algorithm, and the distance between two cells is the best way
+  through the ends of their corridors.
+  """
+  def __init__(self, layout):
+    cells = layout.walls.asList(False)
+    openCells = set(cells)
+    self.neighbors = {}
+    for x, y in cells:
+      self.neighbors[(x, y)] = [cell for cell in [(x,y+1), (x,y-1), (x+1,y), (x-1,y)] if cell in openCells]
+    self.nodes = []
+    self.nodeIds = {}
+    self.edges = []
+    self.cellEdges = {}
+    self.adjacency = []
+    for cell in cells:
+      if len(self.neighbors[cell]) != 2:
+        self._addNode(cell)
+    for node in list(self.nodes):
+      self._traceEdges(node)
+    for cell in cells:
+      # What is left are corridors that loop without reaching a node
+      if cell not in self.nodeIds and cell not in self.cellEdges:
+        self._addNode(cell)
+        self._traceEdges(cell)
+    self._computeNodeDistances()
+    self._table = None
+
+  def _addNode(self, cell):
+    self.nodeIds[cell] = len(self.nodes)
+    self.nodes.append(cell)
+    self.adjacency.append([])
+
+  def _traceEdges(self, node):
+    for first in self.neighbors[node]:
+      if first in self.cellEdges:
+        continue # Traced from its other end already
+      if first in self.nodeIds and self.nodeIds[first] < self.nodeIds[node]:
+        continue
+      previous, cell, corridor = node, first, []
+      while cell not in self.nodeIds:
+        corridor.append(cell)
+        previous, cell = cell, [other for other in self.neighbors[cell] if other != previous][0]
+      edge = len(self.edges)
+      u, v = self.nodeIds[node], self.nodeIds[cell]
+      self.edges.append((u, v, len(corridor) + 1, tuple(corridor)))
+      for steps, corridorCell in enumerate(corridor):
+        self.cellEdges[corridorCell] = (edge, steps + 1)
+      self.adjacency[u].append((v, len(corridor) + 1, edge))
+      if v != u:
+        self.adjacency[v].append((u, len(corridor) + 1, edge))
+
+  def _computeNodeDistances(self):
+    numNodes = len(self.nodes)
+    self.nodeDistances = array('i', [_FAR]) * (numNodes * numNodes)
+    for source in range(numNodes):
+      row = source * numNodes
+      queue = [(0, source)]
+      while queue:
+        distance, node = heapq.heappop(queue)
+        if distance >= self.nodeDistances[row + node]:
+          continue
+        self.nodeDistances[row + node] = distance
+        for other, length, edge in self.adjacency[node]:
+          if distance + length < self.nodeDistances[row + other]:
+            heapq.heappush(queue, (distance + length, other))
+
+  def cellEnds(self, cell):
+    """
+    Returns (edge id, steps from u, ends) for cell, where ends lists the nodes
+    the cell reaches without passing another node and how far they are.  The
+    edge id is None for nodes.
+    """
+    if cell in self.nodeIds:
+      return None, 0, ((self.nodeIds[cell], 0),)
+    edge, steps = self.cellEdges[cell]
+    u, v, length, corridor = self.edges[edge]
+    return edge, steps, ((u, steps), (v, length - steps))
+
+  def distanceTable(self):
+    "A DistanceTable that answers from this graph"
+    if self._table is None:
+      self._table = JunctionDistanceTable(self)
+    return self._table
+
+_FAR = 1 << 30 # Distance between nodes that are not connected
+
+class JunctionDistanceTable(DistanceTable):
+  """
+  A DistanceTable that computes each distance from a JunctionGraph.
+  """
+  def __init__(self, graph):
+    DistanceTable.__init__(self, sorted(graph.neighbors), None)
+    self.graph = graph
+    self.ends = dict((cell, graph.cellEnds(cell)) for cell in self.cells)
+
+  def getDistance(self, pos1, pos2):
+    try:
+      edge1, steps1, ends1 = self.ends[pos1]
+      edge2, steps2, ends2 = self.ends[pos2]
+    except KeyError:
+      raise Exception("Positions not in grid: " + str((pos1, pos2)))
+    best = _FAR
+    if edge1 is not None and edge1 == edge2:
+      best = abs(steps1 - steps2)
+    nodeDistances, numNodes = self.graph.nodeDistances, len(self.graph.nodes)
+    for node1, distance1 in ends1:
+      row = node1 * numNodes
+      for node2, distance2 in ends2:
+        distance = distance1 + nodeDistances[row + node2] + distance2
+        if distance < best:
+          best = distance
+    if best >= _FAR:
+      return sys.maxsize
+    return best
+
+def homeBoundaryField(layout):
+  "The HomeBoundaryField of layout, built once per wall grid"
+  if layout.walls not in homeBoundaryMap:
+    homeBoundaryMap[layout.walls] = HomeBoundaryField(layout)
+  return homeBoundaryMap[layout.walls]
+
+class HomeBoundaryField:
+  """
+  For every open cell, the maze distance to each team's home boundary (the
+  open cells of its column next to the middle of the board) and the boundary
+  cell that distance is measured to, found with one breadth-first search per
+  side from all of its boundary cells at once.
+
+    boundary       {isRed: boundary cells}
+    distances      {isRed: array of distances by cell id}, UNREACHABLE where
+                   no boundary cell can be reached
+    nearestCells   {isRed: array of boundary cell ids by cell id}
+  """
+  def __init__(self, layout):
+    self.cells = layout.walls.asList(False)
+    self.cellIds = dict((cell, i) for i, cell in enumerate(self.cells))
+    neighbors = cellNeighbors(self.cells, self.cellIds)
+    self.boundary = {}
+    self.distances = {}
+    self.nearestCells = {}
+    for isRed in [True, False]:
+      x = layout.width // 2 - 1 if isRed else layout.width // 2
+      self.boundary[isRed] = [(x, y) for y in range(layout.height) if not layout.walls[x][y]]
+      sources = [self.cellIds[cell] for cell in self.boundary[isRed]]
+      distances = array('i', [UNREACHABLE]) * len(self.cells)
+      nearest = array('i', [UNREACHABLE]) * len(self.cells)
+      for source in sources:
+        distances[source] = 0
+        nearest[source] = source
+      queue = deque(sources)
+      while queue:
+        cell = queue.popleft()
+        for neighbor in neighbors[cell]:
+          if distances[neighbor] == UNREACHABLE:
+            distances[neighbor] = distances[cell] + 1
+            nearest[neighbor] = nearest[cell]
+            queue.append(neighbor)
+      self.distances[isRed] = distances
+      self.nearestCells[isRed] = nearest
+
+  def getDistance(self, pos, isRed):
+    distance = self.distances[isRed][self.cellIds[pos]]
+    if distance == UNREACHABLE:
+      return sys.maxsize
+    return distance
+
+  def getNearestCell(self, pos, isRed):
+    nearest = self.nearestCells[isRed][self.cellIds[pos]]
+    if nearest == UNREACHABLE:
+      return None
+    return self.cells[nearest]
+
+def cellNeighbors(cells, cellIds):
+    "The ids of the open cells next to each cell"
+    neighbors = []
+    for x, y in cells:
+        adjacent = [(x,y+1), (x,y-1), (x+1,y), (x-1,y)]
+        neighbors.append([cellIds[cell] for cell in adjacent if cell in cellIds])
+    return neighbors
+
 def computeDistances(layout):
-    "Runs UCS to all other positions from each position"
-    distances = {}
-    allNodes = layout.walls.asList(False)
-    for source in allNodes:
-        dist = {}
-        closed = {}
-        for node in allNodes:
-            dist[node] = sys.maxsize
-        import util
-        queue = util.PriorityQueue()
-        queue.push(source, 0)
-        dist[source] = 0
-        while not queue.isEmpty():
-            node = queue.pop()
-            if node in closed:
-                continue
-            closed[node] = True
-            nodeDist = dist[node]
-            adjacent = []
-            x, y = node
-            if not layout.isWall((x,y+1)):
-                adjacent.append((x,y+1))
-            if not layout.isWall((x,y-1)):
-                adjacent.append((x,y-1) )
-            if not layout.isWall((x+1,y)):
-                adjacent.append((x+1,y) )
-            if not layout.isWall((x-1,y)):
-                adjacent.append((x-1,y))
-            for other in adjacent:
-                if not other in dist:
-                    continue
-                oldDist = dist[other]
-                newDist = nodeDist+1
-                if newDist < oldDist:
-                    dist[other] = newDist
-                    queue.push(other, newDist)
-        for target in allNodes:
-            distances[(target, source)] = dist[target]
+    """
+    Runs a breadth-first search from every open cell (from half of them on
+    symmetric layouts) and returns a DistanceTable
+    """
+    cells, symmetric = tableCells(layout)
+    cellIds = dict((cell, i) for i, cell in enumerate(cells))
+    neighbors = cellNeighbors(cells, cellIds)
+    numSources = numTableRows(len(cells), symmetric)
+    if _NUMPY_ENABLED:
+        return DistanceTable(cells, _frontierDistances(neighbors, numSources), symmetric)
+    return DistanceTable(cells, _breadthFirstDistances(neighbors, numSources), symmetric)
+
+def _frontierDistances(neighbors, numSources):
+    """
+    Expands the BFS frontiers of the first numSources cells at once: row i of
+    frontier marks the sources whose frontier is at cell i.  Row n stays empty
+    and stands in for missing neighbors.
+    """
+    n = len(neighbors)
+    adjacent = numpy.full((n, 4), n, dtype = numpy.intp)
+    for i, cells in enumerate(neighbors):
+        adjacent[i, :len(cells)] = cells
+    distances = numpy.full((n, numSources), UNREACHABLE, dtype = numpy.int16)
+    reached = numpy.eye(n, numSources, dtype = bool)
+    distances[reached] = 0
+    frontier = numpy.zeros((n + 1, numSources), dtype = bool)
+    frontier[:n] = reached
+    distance = 0
+    while True:
+        distance += 1
+        expanded = frontier[adjacent[:, 0]] | frontier[adjacent[:, 1]] | frontier[adjacent[:, 2]] | frontier[adjacent[:, 3]]
+        expanded &= ~reached
+        if not expanded.any():
+            return numpy.ascontiguousarray(distances.T)
+        distances[expanded] = distance
+        reached |= expanded
+        frontier[:n] = expanded
+
+def _breadthFirstDistances(neighbors, numSources):
+    "Plain BFS from the first numSources cells, for when NumPy is not available"
+    distances = array('h')
+    for source in range(numSources):
+        distances.extend(_breadthFirstRow(neighbors, source))
+    return distances
+
+def _breadthFirstRow(neighbors, source):
+    "The distances from source to every cell, as an array('h')"
+    distances = array('h', [UNREACHABLE]) * len(neighbors)
+    distances[source] = 0
+    queue = deque([source])
+    while queue:
+        node = queue.popleft()
+        nodeDist = distances[node] + 1
+        for other in neighbors[node]:
+            if distances[other] == UNREACHABLE:
+                distances[other] = nodeDist
+                queue.append(other)
     return distances
 
 
@@ -0,0 +1,190 @@
+"""
+Ratings for tournaments that only play part of the round robin (see
+run_tournament.py --scheduler swiss).
+
+RatingTable collects game results, fits Bradley-Terry strengths to them (shown
+on the Elo scale, with confidence intervals), decides with a sequential
+probability ratio test when a pairing has played enough games, and pairs the
+teams whose order is still uncertain, Swiss style.
+"""
+
+import math
+
+ELO_SCALE = 400 / math.log(10)
+CONFIDENCE_Z = 1.96  # 95% intervals
+
+# The sequential test of a pairing weighs "team1 wins SPRT_P1 of the games"
+# against "team1 wins SPRT_P0 of them", ignoring draws, and stops once either
+# is accepted with error rates SPRT_ALPHA and SPRT_BETA
+SPRT_P0 = 0.35
+SPRT_P1 = 0.65
+SPRT_ALPHA = 0.05
+SPRT_BETA = 0.05
+
+# Every team is also given PRIOR_GAMES games, half won and half lost, against
+# a fixed opponent of rating 0, which keeps the fit finite for teams that have
+# won or lost every game
+PRIOR_GAMES = 2
+
+
+class RatingTable:
+    """
+    Game results between teams, by pairing: results[(team1, team2)] is
+    [team1 wins, team2 wins, draws], with pairings keyed in the order of teams.
+    failures counts the games of each pairing that could not be played; they
+    do not affect the ratings but do use up the pairing's games.  finished
+    holds the pairings that have no games left to play whatever their count.
+    """
+
+    def __init__(self, teams):
+        self.teams = list(teams)
+        self.order = {team: i for i, team in enumerate(self.teams)}
+        self.results = {}
+        self.failures = {}
+        self.finished = set()
+
+    def pair(self, team1, team2):
+        "The key of the pairing of team1 and team2"
+        if self.order[team1] < self.order[team2]:
+            return team1, team2
+        return team2, team1
+
+    def add_game(self, team1, team2, score):
+        """
+        Adds a game between team1 and team2 with the given score from team1's
+        point of view.
+        """
+        pair = self.pair(team1, team2)
+        if pair[0] != team1:
+            score = -score
+        result = self.results.setdefault(pair, [0, 0, 0])
+        if score > 0:
+            result[0] += 1
+        elif score < 0:
+            result[1] += 1
+        else:
+            result[2] += 1
+
+    def add_failed_game(self, team1, team2):
+        "Records a game between team1 and team2 that could not be played"
+        pair = self.pair(team1, team2)
+        self.failures[pair] = self.failures.get(pair, 0) + 1
+
+    def finish(self, team1, team2):
+        "Marks the pairing of team1 and team2 as needing no more games"
+        self.finished.add(self.pair(team1, team2))
+
+    def num_games(self, team1, team2):
+        return sum(self.results.get(self.pair(team1, team2), [0, 0, 0]))
+
+    def num_attempts(self, team1, team2):
+        "The games of the pairing, played or failed"
+        return self.num_games(team1, team2) + self.failures.get(self.pair(team1, team2), 0)
+
+    def log_likelihood_ratio(self, team1, team2):
+        "The sequential test's statistic; positive favours the first team of the pairing"
+        wins, losses, draws = self.results.get(self.pair(team1, team2), [0, 0, 0])
+        return (wins * math.log(SPRT_P1 / SPRT_P0) +
+                losses * math.log((1 - SPRT_P1) / (1 - SPRT_P0)))
+
+    def is_settled(self, team1, team2, max_games):
+        """
+        Whether the pairing needs no more games: the sequential test has
+        accepted one of its hypotheses either way round, the pairing has
+        played (or failed to play) max_games, or it has been finished.
+        """
+        if self.pair(team1, team2) in self.finished:
+            return True
+        if self.num_attempts(team1, team2) >= max_games:
+            return True
+        upper = math.log((1 - SPRT_BETA) / SPRT_ALPHA)
+        llr = abs(self.log_likelihood_ratio(team1, team2))
+        return llr >= upper
+
+    def fit(self, iterations=1000, tolerance=1e-9):
+        """
+        Fits the Bradley-Terry strength of every team to the results (a draw
+        counts as half a win for each side) with the MM algorithm, and returns
+        {team: (rating, standard error)} on the Elo scale.
+        """
+        wins = {team: PRIOR_GAMES / 2 for team in self.teams}
+        games = {team: {} for team in self.teams}
+        for (team1, team2), (won, lost, drawn) in self.results.items():
+            wins[team1] += won + drawn / 2
+            wins[team2] += lost + drawn / 2
+            played = won + lost + drawn
+            games[team1][team2] = games[team1].get(team2, 0) + played
+            games[team2][team1] = games[team2].get(team1, 0) + played
+
+        strength = {team: 1. for team in self.teams}
+        for _ in range(iterations):
+            change = 0.
+            for team in self.teams:
+                denominator = PRIOR_GAMES / (strength[team] + 1)
+                for opponent, played in games[team].items():
+                    denominator += played / (strength[team] + strength[opponent])
+                updated = wins[team] / denominator
+                change = max(change, abs(math.log(updated / strength[team])))
+                strength[team] = updated
+            if change < tolerance:
+                break
+
+        ratings = {}
+        for team in self.teams:
+            p = strength[team] / (strength[team] + 1)
+            information = PRIOR_GAMES * p * (1 - p)
+            for opponent, played in games[team].items():
+                p = strength[team] / (strength[team] + strength[opponent])
+                information += played * p * (1 - p)
+            ratings[team] = (ELO_SCALE * math.log(strength[team]),
+                             ELO_SCALE / math.sqrt(information))
+        return ratings
+
+    def leaderboard(self, ratings=None):
+        """
+        Returns a row per team, best first: (team, rating, low, high, games,
+        wins, losses, draws), low and high bounding the rating's confidence
+        interval.
+        """
+        if ratings == None:
+            ratings = self.fit()
+        totals = {team: [0, 0, 0] for team in self.teams}
+        for (team1, team2), (won, lost, drawn) in self.results.items():
+            for team, result in [(team1, (won, lost, drawn)), (team2, (lost, won, drawn))]:
+                for i in range(3):
+                    totals[team][i] += result[i]
+        rows = []
+        for team in self.teams:
+            rating, error = ratings[team]
+            won, lost, drawn = totals[team]
+            rows.append((team, rating, rating - CONFIDENCE_Z * error, rating + CONFIDENCE_Z * error,
+                         won + lost + drawn, won, lost, drawn))
+        rows.sort(key=lambda row: -row[1])
+        return rows
+
+    def swiss_pairs(self, max_games, ratings=None):
+        """
+        Pairs the teams for the next round: in rating order, each team not yet
+        paired meets the closest rated team after it whose confidence interval
+        overlaps its own and whose pairing with it is not settled.  Teams with
+        no such opponent sit the round out.
+        """
+        if ratings == None:
+            ratings = self.fit()
+        ranked = sorted(self.teams, key=lambda team: -ratings[team][0])
+        low = {team: ratings[team][0] - CONFIDENCE_Z * ratings[team][1] for team in ranked}
+        high = {team: ratings[team][0] + CONFIDENCE_Z * ratings[team][1] for team in ranked}
+        paired = set()
+        pairs = []
+        for i, team in enumerate(ranked):
+            if team in paired:
+                continue
+            for opponent in ranked[i + 1:]:
+                if opponent in paired or high[opponent] < low[team]:
+                    continue
+                if self.is_settled(team, opponent, max_games):
+                    continue
+                paired.update([team, opponent])
+                pairs.append(self.pair(team, opponent))
+                break
+        return pairs
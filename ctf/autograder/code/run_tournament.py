@@ -1,15 +1,19 @@
 import os
+import json
 import yaml
 import glob
 import itertools
 import capture
+import layout
+import distanceCalculator
+import ratings
 import csv
+import time
 from datetime import datetime
     
 from contextlib import contextmanager
 import sys
 import multiprocessing as mp
-from multiprocessing import Manager
 import argparse
 
 @contextmanager
@@ -25,53 +29,277 @@ def suppress_stdout_and_stderr(path=os.devnull):
             sys.stdout = old_stdout
             sys.stderr = old_stderr
 
-def run_two_team(team1, team2, num_repeats, log_path=os.devnull):
-    layouts = [
-        'defaultCapture',
-        'fastCapture',
-        'alleyCapture',
-        'mediumCapture',
-        'distantCapture',
-        'strategicCapture',
-    ]
-    team1_wins = 0
-    
-    with suppress_stdout_and_stderr(log_path):
-        for _ in range(num_repeats):
-            for l in layouts:
-                pacman_cmd = f'python capture.py -r ./submissions/{team1}.py -b ./submissions/{team2}.py -l {l} -c -q'
-                args = capture.readCommand(pacman_cmd.split()[2:])
-                games = capture.runGames(**args)
-                # Take the average of the game scores. Note that there should be
-                # only one game in games, unless `-n` is used in pacman.py
-                scores = [game.state.data.score for game in games]
-                game_score = sum(scores) / len(scores)
-                if game_score > 0:
-                    team1_wins += 1
-                elif game_score < 0:
-                    team1_wins -= 1
-                
-    if team1_wins > 0:
-        team1_score = 3
-        team2_score = 0
-    elif team1_wins < 0:
-        team1_score = 0
-        team2_score = 3
+LAYOUTS = [
+    'defaultCapture',
+    'fastCapture',
+    'alleyCapture',
+    'mediumCapture',
+    'distantCapture',
+    'strategicCapture',
+]
+
+def share_distance_tables():
+    """
+    Publishes the maze distances of LAYOUTS in shared memory, so that the
+    agents in every worker process attach to one copy instead of each building
+    their own. Returns the blocks to unlink at the end (none before Python 3.8).
+    """
+    if not distanceCalculator._SHARED_MEMORY_ENABLED:
+        return []
+    prefix = f'pd{os.getpid()}_'
+    blocks = distanceCalculator.publishSharedDistances([layout.getLayout(l) for l in LAYOUTS], prefix)
+    os.environ[distanceCalculator.SHARED_DISTANCES_ENV] = prefix
+    return blocks
+
+def layout_cost(layout_name):
+    "Rough relative cost of a game on a layout: its number of open cells"
+    return len(layout.getLayout(layout_name).walls.asList(False))
+
+def make_game_jobs(submissions, num_repeats, both_colours=False):
+    """
+    Splits the round robin into one job per game, (team1, team2, layout, repeat,
+    team1_is_red), ordered longest expected game first so that no long game is
+    left to run alone at the end of the tournament.
+    """
+    jobs = []
+    for team1, team2 in itertools.combinations(submissions, 2):
+        for repeat in range(num_repeats):
+            jobs += make_batch_jobs(team1, team2, repeat, both_colours)
+    return longest_first(jobs)
+
+def make_batch_jobs(team1, team2, repeat, both_colours=False):
+    "The jobs of one game of team1 against team2 on every layout"
+    jobs = []
+    for l in LAYOUTS:
+        jobs.append((team1, team2, l, repeat, True))
+        if both_colours:
+            jobs.append((team1, team2, l, repeat, False))
+    return jobs
+
+def longest_first(jobs):
+    costs = {l: layout_cost(l) for l in LAYOUTS}
+    return sorted(jobs, key=lambda job: -costs[job[2]])
+
+def game_log_path(log_dir, job):
+    team1, team2, l, repeat, team1_is_red = job
+    colour = 'red' if team1_is_red else 'blue'
+    return f'./{log_dir}/{sub_name_to_names(team1)} vs {sub_name_to_names(team2)}/{l}-{repeat}-{colour}.log'
+
+def make_tasks(jobs, log_dir):
+    "The (job, log_path) tasks to play jobs, creating the pairings' log directories"
+    for team1, team2 in set(job[:2] for job in jobs):
+        os.makedirs(f'./{log_dir}/{sub_name_to_names(team1)} vs {sub_name_to_names(team2)}', exist_ok=True)
+    return [(job, game_log_path(log_dir, job)) for job in jobs]
+
+def run_game(job, log_path=os.devnull):
+    """
+    Plays the game of job and returns its result record: the job's fields, the
+    score from team1's point of view whichever colour it played (None if the
+    game could not be run), the error that stopped it, the teams whose
+    submission could not be loaded when it did and how long it took.
+    """
+    team1, team2, l, repeat, team1_is_red = job
+    red, blue = (team1, team2) if team1_is_red else (team2, team1)
+    record = {'team1': team1, 'team2': team2, 'layout': l, 'repeat': repeat,
+              'team1_is_red': team1_is_red, 'score': None, 'error': None, 'failed_teams': []}
+    start = time.time()
+    try:
+        with suppress_stdout_and_stderr(log_path):
+            pacman_cmd = f'python capture.py -r ./submissions/{red}.py -b ./submissions/{blue}.py -l {l} -c -q'
+            args = capture.readCommand(pacman_cmd.split()[2:])
+            games = capture.runGames(**args)
+        # Take the average of the game scores. Note that there should be
+        # only one game in games, unless `-n` is used in pacman.py
+        scores = [game.state.data.score for game in games]
+        game_score = sum(scores) / len(scores)
+        record['score'] = game_score if team1_is_red else -game_score
+    except Exception as e:
+        record['error'] = repr(e)
+        with suppress_stdout_and_stderr():
+            record['failed_teams'] = failing_teams(red, blue)
+    record['seconds'] = time.time() - start
+    return record
+
+def failing_teams(red, blue):
+    "The teams among red and blue whose submission cannot be loaded"
+    failing = []
+    for is_red, team in [(True, red), (False, blue)]:
+        try:
+            agents = capture.loadAgents(is_red, f'./submissions/{team}.py', True, {})
+            loaded = None not in agents
+        except Exception:
+            loaded = False
+        if not loaded:
+            failing.append(team)
+    return failing
+
+def record_job(record):
+    return (record['team1'], record['team2'], record['layout'], record['repeat'], record['team1_is_red'])
+
+def read_journal(path):
+    """
+    Returns the game records in the journal at path, skipping a last line left
+    incomplete by a crash.
+    """
+    records = []
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+def open_journal(path, resume):
+    """
+    Opens the journal for appending, after ending a line left incomplete by a
+    crash, or starts a new one.
+    """
+    if not resume or not os.path.exists(path):
+        return open(path, 'w')
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        complete = f.tell() == 0
+        if not complete:
+            f.seek(-1, os.SEEK_END)
+            complete = f.read(1) == b'\n'
+    journal = open(path, 'a')
+    if not complete:
+        journal.write('\n')
+    return journal
+
+def write_journal(journal, record):
+    "Appends a game record to the journal, on disk before the next game is counted"
+    journal.write(json.dumps(record) + '\n')
+    journal.flush()
+    os.fsync(journal.fileno())
+
+def run_game_task(task):
+    "run_game for pool.imap_unordered, which passes a single (job, log_path)"
+    return run_game(*task)
+
+@contextmanager
+def game_runner(num_processes):
+    """
+    Yields a function that plays a list of tasks and iterates over their game
+    records as they finish, on a pool of num_processes workers sharing the
+    distance tables, or in this process if num_processes is 0.
+    """
+    if num_processes <= 0:
+        yield lambda tasks: map(run_game_task, tasks)
+        return
+    shared_blocks = share_distance_tables()
+    try:
+        with mp.Pool(processes=num_processes) as pool:
+            yield lambda tasks: pool.imap_unordered(run_game_task, tasks)
+    finally:
+        for block in shared_blocks:
+            block.close()
+            block.unlink()
+
+def describe_game(record, progress):
+    names = f'{sub_name_to_names(record["team1"])} vs {sub_name_to_names(record["team2"])}'
+    if record['error'] != None:
+        outcome = f'failed: {record["error"]}'
+        failed = record.get('failed_teams', [])
+        if failed:
+            outcome += ' (could not load ' + ', '.join(sub_name_to_names(team) for team in failed) + ')'
     else:
-        team1_score = 1
-        team2_score = 1
-    
-    team1_name = sub_name_to_names(team1)
-    team2_name = sub_name_to_names(team2)
-    score_board[team1_name] = score_board.get(team1_name, 0) + team1_score
-    score_board[team2_name] = score_board.get(team2_name, 0) + team2_score
-    team1_results = match_board.get(team1_name, {})
-    team1_results[team2_name] = team1_score
-    match_board[team1_name] = team1_results
-    team2_results = match_board.get(team2_name, {})
-    team2_results[team1_name] = team2_score
-    match_board[team2_name] = team2_results
-    return f'{team1_name} vs {team2_name}: {team1_score}'
+        outcome = f'{record["score"]:+g}'
+    colour = 'red' if record['team1_is_red'] else 'blue'
+    return (f'[{progress}] {names} on {record["layout"]} '
+            f'(repeat {record["repeat"]}, {colour}): {outcome} in {record["seconds"]:.1f}s')
+
+class MatchTally:
+    """
+    Aggregates the game records of the tournament in the parent process.  Once
+    all the games of a pairing are in, the match is scored (3 points for the
+    team that won more games, 1 each for a draw) on score_board, {team: points},
+    and match_board, {team: {opponent: points}}.  A game that could not be run
+    because one team's submission does not load is lost by that team; other
+    failed games count for neither.  A pairing none of whose games counted is
+    left unscored.
+    """
+    def __init__(self, jobs):
+        self.score_board = {}
+        self.match_board = {}
+        self.games_left = {}
+        self.team1_wins = {}
+        self.games_counted = {}
+        self.num_games = len(jobs)
+        self.num_done = 0
+        for job in jobs:
+            pair = job[:2]
+            self.games_left[pair] = self.games_left.get(pair, 0) + 1
+            self.team1_wins[pair] = 0
+            self.games_counted[pair] = 0
+
+    def add(self, record):
+        """
+        Adds a game record and returns the progress lines to print about it.
+        """
+        pair = (record['team1'], record['team2'])
+        self.num_done += 1
+        result = game_outcome(record)
+        if result != None:
+            self.team1_wins[pair] += result
+            self.games_counted[pair] += 1
+        lines = [describe_game(record, f'{self.num_done}/{self.num_games}')]
+        self.games_left[pair] -= 1
+        if self.games_left[pair] == 0:
+            if self.games_counted[pair] == 0:
+                lines.append(self.skip_match(pair[0], pair[1]))
+            else:
+                lines.append(self.record_match(pair[0], pair[1], self.team1_wins[pair]))
+        return lines
+
+    def record_match(self, team1, team2, team1_wins):
+        if team1_wins > 0:
+            team1_score = 3
+            team2_score = 0
+        elif team1_wins < 0:
+            team1_score = 0
+            team2_score = 3
+        else:
+            team1_score = 1
+            team2_score = 1
+
+        team1_name = sub_name_to_names(team1)
+        team2_name = sub_name_to_names(team2)
+        self.score_board[team1_name] = self.score_board.get(team1_name, 0) + team1_score
+        self.score_board[team2_name] = self.score_board.get(team2_name, 0) + team2_score
+        self.match_board.setdefault(team1_name, {})[team2_name] = team1_score
+        self.match_board.setdefault(team2_name, {})[team1_name] = team2_score
+        return f'{team1_name} vs {team2_name}: {team1_score}'
+
+    def skip_match(self, team1, team2):
+        team1_name = sub_name_to_names(team1)
+        team2_name = sub_name_to_names(team2)
+        self.score_board.setdefault(team1_name, 0)
+        self.score_board.setdefault(team2_name, 0)
+        return f'{team1_name} vs {team2_name}: unscored, none of its games could be played'
+
+def game_outcome(record):
+    """
+    What a game record counts for: 1 if team1 won, -1 if team2 did, 0 for a
+    draw, None if the game counts for neither.  A game that failed because only
+    one team's submission could not be loaded is lost by that team.
+    """
+    if record['error'] == None:
+        return (record['score'] > 0) - (record['score'] < 0)
+    failed = record.get('failed_teams', [])
+    if failed == [record['team1']]:
+        return -1
+    if failed == [record['team2']]:
+        return 1
+    return None
+
+def add_to_ratings(table, record):
+    outcome = game_outcome(record)
+    if outcome == None:
+        table.add_failed_game(record['team1'], record['team2'])
+    else:
+        table.add_game(record['team1'], record['team2'], outcome)
 
 def sub_name_to_names(sub_name):
     submitters = []
@@ -80,9 +308,17 @@ def sub_name_to_names(sub_name):
     return ','.join(submitters)
     
 def main(args):
-    global score_board
-    global match_board
     global meta
+
+    # The journal is the only record of an interrupted run; never start over
+    # on top of one by accident
+    if not args.resume and not args.overwrite_journal and \
+            os.path.exists(args.journal) and os.path.getsize(args.journal) > 0:
+        sys.exit(f'{args.journal} holds the games of an earlier run: pass --resume to continue it, '
+                 f'or --overwrite-journal (or another --journal) to start a new one.')
+
+    # Keep the layouts' distance tables on disk for the workers and later runs
+    os.environ.setdefault(distanceCalculator.DISTANCE_CACHE_ENV, distanceCalculator.DEFAULT_DISTANCE_CACHE_DIR)
     
     submission_path = args.submission_path
     meta_path = os.path.join(submission_path, 'submission_metadata.yml')
@@ -111,43 +347,53 @@ def main(args):
     date_str = datetime.now().strftime('%Y-%m-%d')
     dst_dir = './submissions'
     log_dir = f'./logs/logs-{date_str}'
-    # clean up
-    if os.path.exists(dst_dir):
-        os.system(f'rm -r {dst_dir}')
-    if os.path.exists(log_dir):
-        os.system(f'rm -r {log_dir}')
-    os.makedirs(dst_dir)
-    os.makedirs(log_dir)
+    # clean up, unless picking up where an earlier run left off
+    if not args.resume:
+        if os.path.exists(dst_dir):
+            os.system(f'rm -r {dst_dir}')
+        if os.path.exists(log_dir):
+            os.system(f'rm -r {log_dir}')
+    os.makedirs(dst_dir, exist_ok=True)
+    os.makedirs(log_dir, exist_ok=True)
     os.makedirs('results', exist_ok=True)
     for sub_name in qualified_submissions:
         src_path = f'{submission_path}/{sub_name}/myTeam.py'
         dst_path = f'{dst_dir}/{sub_name}.py'
         os.system(f'cp {src_path} {dst_path}')
 
+    journal_records = []
+    if args.resume and os.path.exists(args.journal):
+        journal_records = read_journal(args.journal)
+
     # run tournament
-    if args.num_processes > 0:
-        with Manager() as manager:
-            score_board = manager.dict()
-            match_board = manager.dict()
-            pool = mp.Pool(processes=args.num_processes)
-            for team1, team2 in itertools.combinations(qualified_submissions, 2):
-                team1_name = sub_name_to_names(team1)
-                team2_name = sub_name_to_names(team2)
-                log_path = f'./{log_dir}/{team1_name} vs {team2_name}.log'
-                pool.apply_async(run_two_team, args=(team1, team2, args.num_repeats, log_path), callback=lambda x: print(x))
-            pool.close()
-            pool.join()
-            score_board = dict(score_board)
-            match_board = {k: dict(v) for k, v in dict(match_board).items()}
-    
-    else:
-        score_board = {}
-        match_board = {}
-        for team1, team2 in itertools.combinations(qualified_submissions, 2):
-            team1_name = sub_name_to_names(team1)
-            team2_name = sub_name_to_names(team2)
-            log_path = f'./{log_dir}/{team1_name} vs {team2_name}.log'
-            print(run_two_team(team1, team2, args.num_repeats, log_path=log_path))
+    with game_runner(args.num_processes) as play, open_journal(args.journal, args.resume) as journal:
+        if args.scheduler == 'swiss':
+            run_swiss(qualified_submissions, args, log_dir, date_str, journal_records, play, journal)
+        else:
+            run_round_robin(qualified_submissions, args, log_dir, date_str, journal_records, play, journal)
+
+def run_round_robin(qualified_submissions, args, log_dir, date_str, journal_records, play, journal):
+    # Games already in the journal are counted again rather than replayed;
+    # those that failed are played again
+    played = {}
+    for record in journal_records:
+        if record['error'] == None:
+            played[record_job(record)] = record
+    jobs = make_game_jobs(qualified_submissions, args.num_repeats, args.both_colours)
+    tally = MatchTally(jobs)
+    for job in jobs:
+        if job in played:
+            tally.add(played[job])
+    jobs = [job for job in jobs if job not in played]
+    if args.resume:
+        print(f'Resuming: {tally.num_done} games already played, {len(jobs)} to go.')
+
+    for record in play(make_tasks(jobs, log_dir)):
+        write_journal(journal, record)
+        for line in tally.add(record):
+            print(line, flush=True)
+    score_board = tally.score_board
+    match_board = tally.match_board
 
     print('Score Board:') 
     for k, v in score_board.items():
@@ -167,7 +413,79 @@ def main(args):
             for team in qualified_submissions:
                 row.append(v.get(sub_name_to_names(team), ''))
             writer.writerow(row)
-            
+
+def run_swiss(qualified_submissions, args, log_dir, date_str, journal_records, play, journal):
+    """
+    Plays rounds of Swiss pairings (see ratings.RatingTable.swiss_pairs) in
+    which every pairing plays one game on each layout, until no pairing is
+    left whose order is uncertain or args.max_rounds rounds have been played.
+    A pairing stops once the sequential test has settled it or it has played
+    as many games as in the round robin, games that failed included.  Writes a
+    leaderboard of ratings with confidence intervals.
+    """
+    table = ratings.RatingTable(qualified_submissions)
+    # Every game in the journal counts, failed or not, so that resuming does
+    # not keep retrying a pairing that cannot be played
+    attempted = {}
+    for record in journal_records:
+        job = record_job(record)
+        if job[0] in table.order and job[1] in table.order:
+            if job not in attempted or record['error'] == None:
+                attempted[job] = record
+    for record in attempted.values():
+        add_to_ratings(table, record)
+    if args.resume:
+        print(f'Resuming: {len(table.results)} pairings already played.')
+    games_per_batch = len(make_batch_jobs(None, None, 0, args.both_colours))
+    max_games = args.num_repeats * games_per_batch
+    num_games = 0
+    num_rounds = 0
+    while args.max_rounds < 0 or num_rounds < args.max_rounds:
+        pairs = table.swiss_pairs(max_games)
+        if not pairs:
+            break
+        jobs = []
+        playing = []
+        for team1, team2 in pairs:
+            # The pairing plays its first batch with games missing from the
+            # journal, so a batch cut short by a crash is finished rather than
+            # started over, and a journal written with or without
+            # --both-colours is filled in rather than played again.  A pairing
+            # with no games missing is finished.
+            batch = []
+            repeat = 0
+            while not batch and repeat < args.num_repeats:
+                batch = [job for job in make_batch_jobs(team1, team2, repeat, args.both_colours) if job not in attempted]
+                repeat += 1
+            if batch:
+                playing.append((team1, team2))
+                jobs += batch
+            else:
+                table.finish(team1, team2)
+        if not jobs:
+            continue
+        num_rounds += 1
+        print(f'Round {num_rounds}: ' + ', '.join(
+            f'{sub_name_to_names(team1)} vs {sub_name_to_names(team2)}' for team1, team2 in playing), flush=True)
+        for record in play(make_tasks(longest_first(jobs), log_dir)):
+            write_journal(journal, record)
+            attempted[record_job(record)] = record
+            add_to_ratings(table, record)
+            num_games += 1
+            print(describe_game(record, num_games), flush=True)
+    round_robin_games = len(qualified_submissions) * (len(qualified_submissions) - 1) // 2 * max_games
+    print(f'{num_games} games played in {num_rounds} rounds ({round_robin_games} in a round robin).')
+
+    leaderboard = table.leaderboard()
+    print('Leaderboard:')
+    for team, rating, low, high, games, won, lost, drawn in leaderboard:
+        print(f'{sub_name_to_names(team)}: {rating:.0f} [{low:.0f}, {high:.0f}] ({won}-{lost}-{drawn})')
+    with open(f'results/leaderboard-{date_str}.csv', 'w') as f:
+        writer = csv.writer(f, delimiter='\t')
+        writer.writerow(['team', 'rating', 'low', 'high', 'games', 'wins', 'losses', 'draws'])
+        for team, rating, low, high, games, won, lost, drawn in leaderboard:
+            writer.writerow([sub_name_to_names(team), f'{rating:.1f}', f'{low:.1f}', f'{high:.1f}', games, won, lost, drawn])
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('-s', '--submission-path', type=str, required=True)
@@ -175,5 +493,12 @@ if __name__ == '__main__':
     parser.add_argument('-n', '--num-processes', type=int, default=1)
     parser.add_argument('-r', '--num-repeats', type=int, default=3)
     parser.add_argument('--num-teams', type=int, default=-1, help='-1 means all')
+    parser.add_argument('--both-colours', action='store_true', help='also play every game with the teams swapped')
+    parser.add_argument('--journal', type=str, default='results/journal.jsonl', help='file the result of every finished game is appended to')
+    parser.add_argument('--resume', action='store_true', help='skip the games already in the journal instead of starting over')
+    parser.add_argument('--overwrite-journal', action='store_true', help='start a new journal even if the old one is not empty')
+    parser.add_argument('--scheduler', choices=['round-robin', 'swiss'], default='round-robin',
+                        help='play every pairing, or Swiss rounds of the pairings whose order is still uncertain')
+    parser.add_argument('--max-rounds', type=int, default=-1, help='rounds of the swiss scheduler; -1 means until settled')
     args = parser.parse_args()
     main(args)
\ No newline at end of file
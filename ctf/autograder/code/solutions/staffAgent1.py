@@ -61,22 +61,8 @@ def softmax(values):
     return logits / np.sum(logits)
 
 
-def collect_home_boundary(agent, gameState):
-    halfway = gameState.data.layout.width // 2
-    height = gameState.data.layout.height
-    boundary_red = [
-        (halfway - 1, y) for y in range(height)
-        if not gameState.data.layout.walls[halfway - 1][y]]
-    boundary_blu = [
-        (halfway, y) for y in range(height)
-        if not gameState.data.layout.walls[halfway][y]]
-    return {True: boundary_red, False: boundary_blu}
-
-
 def mazeDistanceToHome(agent, pos, gameState):
-    dist = min([agent.getMazeDistance(pos, pos_boundary)
-                for pos_boundary in agent.home_boundary[agent.red]])
-    return dist
+    return agent.getDistanceToHome(pos)
 
 
 class ReflexCaptureAgent(CaptureAgent):
@@ -86,7 +72,6 @@ class ReflexCaptureAgent(CaptureAgent):
 
   def registerInitialState(self, gameState):
     self.start = gameState.getAgentPosition(self.index)
-    self.home_boundary = collect_home_boundary(self, gameState)
     CaptureAgent.registerInitialState(self, gameState)
 
   def chooseAction(self, gameState):
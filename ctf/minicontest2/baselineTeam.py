@@ -143,7 +143,7 @@ class OffensiveReflexAgent(ReflexCaptureAgent):
 
     if len(foodList) > 0: # This should always be True,  but better safe than sorry
       myPos = successor.getAgentState(self.index).getPosition()
-      minDistance = min([self.getMazeDistance(myPos, food) for food in foodList])
+      minDistance = self.getNearest(myPos, foodList)[1]
       features['distanceToFood'] = minDistance
     return features
 
@@ -0,0 +1,350 @@
+# batchCapture.py
+# ---------------
+# Licensing Information:  You are free to use or extend these projects for
+# educational purposes provided that (1) you do not distribute or publish
+# solutions, (2) you retain this notice, and (3) you provide clear
+# attribution to UC Berkeley, including a link to http://ai.berkeley.edu.
+#
+# Attribution Information: The Pacman AI projects were developed at UC Berkeley.
+# The core projects and autograders were primarily created by John DeNero
+# (denero@cs.berkeley.edu) and Dan Klein (klein@cs.berkeley.edu).
+# Student side autograding was added by Brad Miller, Nick Hay, and
+# Pieter Abbeel (pabbeel@cs.berkeley.edu).
+
+"""
+batchCapture.py runs many capture games on the same layout in lockstep.
+
+The state of all N games is held in NumPy arrays (one row per game) and every
+call to step() applies the rules of capture.AgentRules to all of the games at
+once, so self-play and simulation-heavy training loops do not pay for one
+GameState object per move.  The rules are exactly those of capture.py: fed the
+same actions, a batch game goes through the same states as the scalar engine.
+
+Actions are integers indexing ACTIONS.  A typical loop looks like:
+
+  games = BatchGames(layout.getLayout('defaultCapture'), numGames = 1000)
+  while not games.done.all():
+    legal = games.getLegalActions()          # [N, 5] bool, for the agent to move
+    games.stepAgent(chooseActions(legal))    # [N] ints
+
+Rare events that do not vectorize well (a Pacman dropping the food it carries
+when it dies) fall back to a loop over just the games they happen in.
+"""
+
+from game import Directions
+from game import BitGrid
+from game import Configuration
+import capture
+
+try:
+  import numpy
+  _NUMPY_ENABLED = True
+except:
+  _NUMPY_ENABLED = False
+
+ACTIONS = [Directions.NORTH, Directions.SOUTH, Directions.EAST, Directions.WEST, Directions.STOP]
+ACTION_INDEX = dict([(action, i) for i, action in enumerate(ACTIONS)])
+STOP = ACTION_INDEX[Directions.STOP]
+DX = [0, 0, 1, -1, 0]
+DY = [1, -1, 0, 0, 0]
+
+NUM_AGENTS = 4
+
+class BatchGames:
+  """
+  N capture games on one layout, advanced one agent move at a time.
+
+  Public arrays (N games, 4 agents, C capsules of the layout):
+    positions    [N, 4, 2] agent grid positions
+    directions   [N, 4]    index into ACTIONS of each agent's direction
+    isPacman     [N, 4]
+    scaredTimer  [N, 4]
+    numCarrying  [N, 4]
+    numReturned  [N, 4]
+    food         [N, width, height] bool
+    capsules     [N, C] bool, whether layout.capsules[c] is still there
+    score        [N]
+    numMoves     [N]    agent moves made so far
+    agentToMove  [N]
+    done         [N]    the game is over and ignores further actions
+  """
+
+  def __init__( self, layout, numGames, length = 1200, startingIndex = 0 ):
+    if not _NUMPY_ENABLED:
+      raise Exception('batchCapture needs numpy')
+    self.layout = layout
+    self.numGames = numGames
+    self.length = length
+    width, height = layout.width, layout.height
+
+    # Per-layout tables
+    self.legalMask = numpy.zeros((width, height, len(ACTIONS)), dtype = bool)
+    for (x, y), actions in layout.legalActions.items():
+      for action in actions:
+        self.legalMask[x, y, ACTION_INDEX[action]] = True
+    self.walls = numpy.array(layout.walls.data, dtype = bool)
+    self.start = numpy.array([pos for i, pos in layout.agentPositions[:NUM_AGENTS]], dtype = numpy.int64)
+    if len(self.start) != NUM_AGENTS:
+      raise Exception('batchCapture needs a layout with %d agents' % NUM_AGENTS)
+    self.teamIsRed = numpy.array([2 * x < width for x, y in self.start])
+    red = [i for i in range(NUM_AGENTS) if self.teamIsRed[i]]
+    blue = [i for i in range(NUM_AGENTS) if not self.teamIsRed[i]]
+    self.teammates = numpy.array([red if self.teamIsRed[i] else blue for i in range(NUM_AGENTS)])
+    self.opponents = numpy.array([blue if self.teamIsRed[i] else red for i in range(NUM_AGENTS)])
+    self.capsulePositions = numpy.array(layout.capsules, dtype = numpy.int64).reshape(-1, 2)
+    halfway = width // 2
+    # Which capsules each team can eat (see capture.halfList)
+    self.edibleCapsules = numpy.array([self.capsulePositions[:, 0] <= halfway,
+                                       self.capsulePositions[:, 0] > halfway])
+    self.winThreshold = (layout.totalFood / 2) - capture.MIN_FOOD
+
+    # Per-game state
+    n = numGames
+    self.positions = numpy.tile(self.start, (n, 1, 1))
+    self.directions = numpy.full((n, NUM_AGENTS), STOP, dtype = numpy.int64)
+    self.isPacman = numpy.zeros((n, NUM_AGENTS), dtype = bool)
+    self.scaredTimer = numpy.zeros((n, NUM_AGENTS), dtype = numpy.int64)
+    self.numCarrying = numpy.zeros((n, NUM_AGENTS), dtype = numpy.int64)
+    self.numReturned = numpy.zeros((n, NUM_AGENTS), dtype = numpy.int64)
+    self.food = numpy.tile(numpy.array(layout.food.data, dtype = bool), (n, 1, 1))
+    self.capsules = numpy.ones((n, len(self.capsulePositions)), dtype = bool)
+    self.score = numpy.zeros(n, dtype = numpy.int64)
+    self.numMoves = numpy.zeros(n, dtype = numpy.int64)
+    self.agentToMove = numpy.zeros(n, dtype = numpy.int64) + startingIndex
+    self.done = numpy.zeros(n, dtype = bool)
+
+  def getLegalActions( self, agentIndex = None ):
+    """
+    Returns an [N, 5] bool array of the actions agentIndex (an int or one index
+    per game; by default the agent to move) may take in each game.
+    """
+    if agentIndex is None: agentIndex = self.agentToMove
+    games = numpy.arange(self.numGames)
+    agentIndex = numpy.broadcast_to(agentIndex, (self.numGames,))
+    pos = self.positions[games, agentIndex]
+    return self.legalMask[pos[:, 0], pos[:, 1]]
+
+  def step( self, actions ):
+    """
+    Plays one round: actions is an [N, 4] array and each agent in turn (from
+    agentToMove) takes actions[:, agentIndex].  Note that all four actions are
+    chosen before the round starts; use stepAgent to look at the state between
+    the moves.
+    """
+    actions = numpy.asarray(actions)
+    games = numpy.arange(self.numGames)
+    for i in range(NUM_AGENTS):
+      self.stepAgent(actions[games, self.agentToMove])
+
+  def stepAgent( self, actions ):
+    """
+    The agent to move in each game takes actions[game].  Finished games are
+    left alone.
+    """
+    g = numpy.nonzero(~self.done)[0]
+    if len(g) == 0: return
+    a = self.agentToMove[g]
+    act = numpy.asarray(actions)[g]
+    x, y = self.positions[g, a, 0], self.positions[g, a, 1]
+
+    illegal = ~self.legalMask[x, y, act]
+    if illegal.any():
+      i = numpy.nonzero(illegal)[0][0]
+      raise Exception("Illegal action %s in game %d" % (ACTIONS[act[i]], g[i]))
+    isRed = self.teamIsRed[a]
+    scoreChange = numpy.zeros(len(g), dtype = numpy.int64)
+
+    # Update Configuration
+    x = x + numpy.take(DX, act)
+    y = y + numpy.take(DY, act)
+    self.positions[g, a, 0] = x
+    self.positions[g, a, 1] = y
+    self.directions[g, a] = numpy.where(act == STOP, self.directions[g, a], act)
+
+    # Change agent type and bring food home
+    isPacman = isRed != (2 * x < self.layout.width)
+    self.isPacman[g, a] = isPacman
+    carrying = self.numCarrying[g, a]
+    returned = (carrying > 0) & ~isPacman
+    scoreChange += numpy.where(returned, numpy.where(isRed, carrying, -carrying), 0)
+    self.numReturned[g, a] += numpy.where(returned, carrying, 0)
+    self.numCarrying[g, a] = numpy.where(returned, 0, carrying)
+    redCount = (self.numReturned[g] * self.teamIsRed).sum(axis = 1)
+    blueCount = (self.numReturned[g] * ~self.teamIsRed).sum(axis = 1)
+    win = returned & ((redCount >= self.winThreshold) | (blueCount >= self.winThreshold))
+
+    # Eat.  AgentRules.applyAction looks at the last agent, not the mover,
+    # after food is brought home; this is kept so the results stay the same.
+    eats = numpy.where(returned, self.isPacman[g, NUM_AGENTS - 1], isPacman)
+    self.consume(g[eats], a[eats], x[eats], y[eats])
+
+    scoreChange += self.checkDeath(g, a)
+
+    # Decrement the mover's scared timer
+    self.scaredTimer[g, a] = numpy.maximum(0, self.scaredTimer[g, a] - 1)
+
+    self.score[g] += scoreChange
+    self.numMoves[g] += 1
+    self.agentToMove[g] = (a + 1) % NUM_AGENTS
+    self.done[g] = win | (self.numMoves[g] >= self.length)
+
+  def consume( self, g, a, x, y ):
+    """
+    Agents a eat the food or capsule at (x, y) in games g.
+    """
+    if len(g) == 0: return
+    hasFood = self.food[g, x, y]
+    fg, fa, fx, fy = g[hasFood], a[hasFood], x[hasFood], y[hasFood]
+    # The first teammate standing on the food gets it
+    first, second = self.teammates[fa, 0], self.teammates[fa, 1]
+    firstThere = (self.positions[fg, first] == numpy.stack([fx, fy], axis = 1)).all(axis = 1)
+    self.numCarrying[fg, numpy.where(firstThere, first, second)] += 1
+    self.food[fg, fx, fy] = False
+
+    if len(self.capsulePositions) == 0: return
+    eaten = (self.capsules[g]
+             & (self.capsulePositions[:, 0] == x[:, None])
+             & (self.capsulePositions[:, 1] == y[:, None])
+             & self.edibleCapsules[self.teamIsRed[a].astype(int)])
+    self.capsules[g] &= ~eaten
+    ate = eaten.any(axis = 1)
+    for column in range(2):
+      self.scaredTimer[g[ate], self.opponents[a[ate], column]] = capture.SCARED_TIME
+
+  def checkDeath( self, g, a ):
+    """
+    Resolves collisions between movers a and their opponents in games g and
+    returns the score change.
+    """
+    scoreChange = numpy.zeros(len(g), dtype = numpy.int64)
+    moverIsPacman = self.isPacman[g, a]
+    sign = numpy.where(self.teamIsRed[a], -1, 1)
+    for column in range(2):
+      o = self.opponents[a, column]
+      together = (self.positions[g, a] == self.positions[g, o]).all(axis = 1)
+      otherIsPacman = self.isPacman[g, o]
+      # A Pacman mover meets a ghost
+      meets = moverIsPacman & ~otherIsPacman & together
+      ghostScared = self.scaredTimer[g, o] > 0
+      moverDies = meets & ~ghostScared
+      otherDies = meets & ghostScared
+      scoreChange += numpy.where(meets, sign * capture.KILL_POINTS, 0)
+      # A ghost mover meets a Pacman
+      meets = ~moverIsPacman & otherIsPacman & together
+      moverScared = self.scaredTimer[g, a] > 0
+      scoreChange += numpy.where(meets & ~moverScared, -sign * capture.KILL_POINTS, 0)
+      scoreChange += numpy.where(meets & moverScared, sign * capture.KILL_POINTS, 0)
+      otherDies |= meets & ~moverScared
+      moverDies |= meets & moverScared
+
+      # Pacmen drop their food where they die, before anyone is sent home
+      for dead, agents in ((moverDies, a), (otherDies, o)):
+        dead = dead & self.isPacman[g, agents] & (self.numCarrying[g, agents] > 0)
+        for game, agent in zip(g[dead], agents[dead]):
+          self.dumpFoodFromDeath(game, agent)
+      self.sendHome(g[moverDies], a[moverDies])
+      self.sendHome(g[otherDies], o[otherDies])
+    return scoreChange
+
+  def sendHome( self, g, a ):
+    self.isPacman[g, a] = False
+    self.positions[g, a] = self.start[a]
+    self.directions[g, a] = STOP
+    self.scaredTimer[g, a] = 0
+
+  def dumpFoodFromDeath( self, game, agent ):
+    """
+    Scatters the food agent carries around where it died, in the same order
+    as AgentRules.dumpFoodFromDeath.  Only called for the few games it applies to.
+    """
+    if not capture.DUMP_FOOD_ON_DEATH: return
+    width, height = self.layout.width, self.layout.height
+    start = tuple(int(v) for v in self.positions[game, agent])
+    isRed = 2 * start[0] < width
+    agentPositions = set(tuple(int(v) for v in p) for p in self.positions[game])
+    capsules = set(tuple(int(v) for v in p) for p in self.capsulePositions[self.capsules[game]])
+    food = self.food[game]
+
+    numToDump = int(self.numCarrying[game, agent])
+    positionQueue = [start]
+    seen = set()
+    while numToDump > 0:
+      if not len(positionQueue):
+        raise Exception('Exhausted BFS! uh oh')
+      popped = positionQueue.pop(0)
+      if popped in seen:
+        continue
+      seen.add(popped)
+      x, y = popped
+      if (0 < x < width and 0 < y < height and not self.walls[x, y] and not food[x, y]
+          and (2 * x < width) == isRed and popped not in capsules and popped not in agentPositions):
+        food[x, y] = True
+        numToDump -= 1
+      positionQueue = positionQueue + [(x + dx, y + dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+    self.numCarrying[game, agent] = 0
+
+  def getResults( self ):
+    """
+    Returns the final score of every game (positive means red won).
+    """
+    return self.score.copy()
+
+  def getGameState( self, game ):
+    """
+    Returns game as a capture.GameState, e.g. to hand it to a regular agent.
+    """
+    state = capture.GameState()
+    state.initialize(self.layout, NUM_AGENTS)
+    data = state.data
+    for index in range(NUM_AGENTS):
+      agentState = data.agentStates[index]
+      x, y = self.positions[game, index]
+      agentState.configuration = Configuration((int(x), int(y)), ACTIONS[self.directions[game, index]])
+      agentState.isPacman = bool(self.isPacman[game, index])
+      agentState.scaredTimer = int(self.scaredTimer[game, index])
+      agentState.numCarrying = int(self.numCarrying[game, index])
+      agentState.numReturned = int(self.numReturned[game, index])
+    food = BitGrid(self.layout.width, self.layout.height)
+    for x, y in numpy.argwhere(self.food[game]):
+      food[int(x)][int(y)] = True
+    data.food = food.freeze()
+    data.capsules = [tuple(int(v) for v in p) for p in self.capsulePositions[self.capsules[game]]]
+    data.score = int(self.score[game])
+    data.timeleft = self.length - int(self.numMoves[game])
+    data.resetZobristKey()
+    return state
+
+def runRandomGames( layout, numGames, length = 1200, seed = None ):
+  """
+  Plays numGames games of uniformly random agents and returns the scores.
+  """
+  random = numpy.random.RandomState(seed)
+  games = BatchGames(layout, numGames, length, random.randint(2, size = numGames))
+  while not games.done.all():
+    legal = games.getLegalActions()
+    choice = numpy.where(legal, random.random_sample(legal.shape), -1).argmax(axis = 1)
+    games.stepAgent(choice)
+  return games.getResults()
+
+if __name__ == '__main__':
+  """
+  Plays random games in a batch and reports the outcome and speed:
+
+  > python batchCapture.py -l defaultCapture -n 1000
+  """
+  import sys, time
+  from optparse import OptionParser
+  import layout as layoutModule
+  parser = OptionParser('python batchCapture.py -l LAYOUT -n NUMGAMES')
+  parser.add_option('-l', '--layout', dest = 'layout', default = 'defaultCapture')
+  parser.add_option('-n', '--numGames', type = 'int', dest = 'numGames', default = 100)
+  parser.add_option('-i', '--time', type = 'int', dest = 'time', default = 1200)
+  parser.add_option('--fixRandomSeed', type = 'int', dest = 'seed', default = None)
+  options, otherjunk = parser.parse_args(sys.argv[1:])
+  layout = layoutModule.getLayout(options.layout)
+  if layout is None: raise Exception("The layout " + options.layout + " cannot be found")
+  started = time.time()
+  scores = runRandomGames(layout, options.numGames, options.time, options.seed)
+  elapsed = time.time() - started
+  print('Red wins %d, blue wins %d, ties %d' % ((scores > 0).sum(), (scores < 0).sum(), (scores == 0).sum()))
+  print('%d games in %.2f seconds (%.0f moves per second)' % (options.numGames, elapsed, options.numGames * options.time / elapsed))
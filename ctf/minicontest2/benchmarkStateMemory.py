@@ -0,0 +1,81 @@
+# benchmarkStateMemory.py
+# -----------------------
+# Licensing Information:  You are free to use or extend these projects for
+# educational purposes provided that (1) you do not distribute or publish
+# solutions, (2) you retain this notice, and (3) you provide clear
+# attribution to UC Berkeley, including a link to http://ai.berkeley.edu.
+#
+# Attribution Information: The Pacman AI projects were developed at UC Berkeley.
+# The core projects and autograders were primarily created by John DeNero
+# (denero@cs.berkeley.edu) and Dan Klein (klein@cs.berkeley.edu).
+# Student side autograding was added by Brad Miller, Nick Hay, and
+# Pieter Abbeel (pabbeel@cs.berkeley.edu).
+
+"""
+Measures how many bytes each GameState takes and how fast successors are
+generated, with tracemalloc, on a random playout:
+
+  > python benchmarkStateMemory.py -l jumboCapture -n 2000
+
+"successor chain" keeps every state of the playout alive, as a search tree
+does; "observation copy" keeps a deepCopy of each, as
+CaptureAgent.observationHistory does.  Run it on two checkouts to compare them.
+"""
+
+import sys, time, random, tracemalloc
+import capture
+import layout as layoutModule
+
+def bytesPerState(layout, numStates, copy, seed = 0):
+  """
+  Plays numStates random moves on layout keeping every state (or a deepCopy
+  of it) and returns the bytes allocated per state.
+  """
+  random.seed(seed)
+  state = capture.GameState()
+  state.initialize(layout, 4)
+  state.data.timeleft = numStates
+  kept = []
+  tracemalloc.start()
+  base = tracemalloc.get_traced_memory()[0]
+  agentIndex = 0
+  for _ in range(numStates):
+    state = state.generateSuccessor(agentIndex, random.choice(state.getLegalActions(agentIndex)))
+    kept.append(state.deepCopy() if copy else state)
+    agentIndex = (agentIndex + 1) % 4
+  used = tracemalloc.get_traced_memory()[0] - base
+  tracemalloc.stop()
+  return used / numStates
+
+def secondsPerSuccessor(layout, numStates, seed = 0):
+  random.seed(seed)
+  state = capture.GameState()
+  state.initialize(layout, 4)
+  state.data.timeleft = numStates
+  actions = []
+  agentIndex = 0
+  for _ in range(numStates):
+    action = random.choice(state.getLegalActions(agentIndex))
+    actions.append(action)
+    state = state.generateSuccessor(agentIndex, action)
+    agentIndex = (agentIndex + 1) % 4
+  state = capture.GameState()
+  state.initialize(layout, 4)
+  state.data.timeleft = numStates
+  started = time.time()
+  for i, action in enumerate(actions):
+    state = state.generateSuccessor(i % 4, action)
+  return (time.time() - started) / numStates
+
+if __name__ == '__main__':
+  from optparse import OptionParser
+  parser = OptionParser('python benchmarkStateMemory.py [-l LAYOUT] [-n STATES]')
+  parser.add_option('-l', '--layout', dest = 'layout', default = 'jumboCapture')
+  parser.add_option('-n', '--numStates', type = 'int', dest = 'numStates', default = 2000)
+  options, otherjunk = parser.parse_args(sys.argv[1:])
+  layout = layoutModule.getLayout(options.layout)
+  if layout is None: raise Exception("The layout " + options.layout + " cannot be found")
+  print('%s, %d states' % (options.layout, options.numStates))
+  print('successor chain:  %6.0f bytes per state' % bytesPerState(layout, options.numStates, False))
+  print('observation copy: %6.0f bytes per state' % bytesPerState(layout, options.numStates, True))
+  print('generateSuccessor: %.1f microseconds' % (1e6 * secondsPerSuccessor(layout, options.numStates)))
@@ -55,6 +55,7 @@ from game import Actions
 from util import nearestPoint
 from util import manhattanDistance
 from game import Grid
+from game import BitGrid
 from game import Configuration
 from game import Agent
 from game import reconstituteGrid
@@ -97,6 +98,7 @@ class GameState:
   strongly suggest that you access that data via the accessor methods below rather
   than referring to the GameStateData object directly.
   """
+  __slots__ = ('data', 'blueTeam', 'redTeam', 'teams', 'agentDistances', '_undoStack', '_isSnapshot')
 
   ####################################################
   # Accessor methods: use these to access state data #
@@ -118,16 +120,70 @@ class GameState:
     # Find appropriate rules for the agent
     AgentRules.applyAction( state, action, agentIndex )
     AgentRules.checkDeath(state, agentIndex)
-    AgentRules.decrementTimer(state.data.agentStates[agentIndex])
+    AgentRules.decrementTimer(state.data.writableAgentState(agentIndex))
 
     # Book keeping
+    state.data.updateAgentZobrist(self.data.agentStates)
     state.data._agentMoved = agentIndex
     state.data.score += state.data.scoreChange
     state.data.timeleft = self.data.timeleft - 1
     return state
 
+  def push( self, agentIndex, action ):
+    """
+    Applies the action to this state in place, with exactly the same result as
+    generateSuccessor, and remembers how to undo it.  Each push must be matched
+    by a call to pop, which is cheaper than generating a successor when walking
+    a search tree depth-first:
+
+      state.push(agentIndex, action)
+      value = search(state)
+      state.pop()
+    """
+    data = self.data
+    previousAgentStates = data.agentStates
+    record = data.beginUndoableMove()
+    try:
+      AgentRules.applyAction( self, action, agentIndex )
+      AgentRules.checkDeath(self, agentIndex)
+      AgentRules.decrementTimer(data.writableAgentState(agentIndex))
+    except:
+      data.undoMove(record)
+      raise
+
+    # Book keeping
+    data.updateAgentZobrist(previousAgentStates)
+    data._agentMoved = agentIndex
+    data.score += data.scoreChange
+    data.timeleft -= 1
+    stack = getattr(self, '_undoStack', None)
+    if stack is None:
+      stack = self._undoStack = []
+    stack.append(record)
+
+  def pop( self ):
+    """
+    Undoes the most recent push that has not been undone yet.
+    """
+    if not getattr(self, '_undoStack', None):
+      raise Exception('pop called without a matching push')
+    self.data.undoMove(self._undoStack.pop())
+
+  def key( self ):
+    """
+    Returns a 64-bit Zobrist key of the state that is kept up to date as moves
+    are applied, so it costs O(1).  Unlike hash(state), it is cheap enough to key
+    transposition tables or detect repeated positions during search.
+    """
+    return self.data.zobristKey()
+
   def getAgentState(self, index):
-    return self.data.agentStates[index]
+    """
+    Returns the AgentState of the agent.  States share unchanged AgentStates
+    with their successors, so this hands out the state's own copy, and changing
+    it does not affect any other state.
+    """
+    return self.data.writableAgentState(index)
 
   def getAgentPosition(self, index):
     """
@@ -154,22 +210,28 @@ class GameState:
     Returns a matrix of food that corresponds to the food on the red team's side.
     For the matrix m, m[x][y]=true if there is food in (x,y) that belongs to
     red (meaning red is protecting it, blue is trying to eat it).
+
+    The matrix is cached and shared between states, so it is read-only; call
+    copy() on it to get one you can modify.
     """
-    return halfGrid(self.data.food, red = True)
+    return teamFood(self.data, red = True)
 
   def getBlueFood(self):
     """
     Returns a matrix of food that corresponds to the food on the blue team's side.
     For the matrix m, m[x][y]=true if there is food in (x,y) that belongs to
     blue (meaning blue is protecting it, red is trying to eat it).
+
+    The matrix is cached and shared between states, so it is read-only; call
+    copy() on it to get one you can modify.
     """
-    return halfGrid(self.data.food, red = False)
+    return teamFood(self.data, red = False)
 
   def getRedCapsules(self):
-    return halfList(self.data.capsules, self.data.food, red = True)
+    return list(teamCapsules(self.data, red = True))
 
   def getBlueCapsules(self):
-    return halfList(self.data.capsules, self.data.food, red = False)
+    return list(teamCapsules(self.data, red = False))
 
   def getWalls(self):
     """
@@ -237,7 +299,7 @@ class GameState:
     """
     Returns a list of positions (x,y) of the remaining capsules.
     """
-    return self.data.capsules
+    return list(self.data.capsules)
 
   #############################################
   #             Helper methods:               #
@@ -271,8 +333,30 @@ class GameState:
     state.agentDistances = self.agentDistances[:]
     return state
 
+  def snapshot( self ):
+    """
+    Returns a copy of the state to hand to an agent as its observation.  It is
+    as independent of this state as a deepCopy, except that the food grid is
+    shared and read-only.  makeObservation returns a snapshot unchanged, so the
+    game makes one copy per turn rather than two.
+    """
+    state = GameState( self )
+    state.data = self.data.snapshot()
+    state.data.timeleft = self.data.timeleft
+    state._isSnapshot = True
+
+    state.blueTeam = self.blueTeam[:]
+    state.redTeam = self.redTeam[:]
+    state.teams = self.teams[:]
+    state.agentDistances = self.agentDistances[:]
+    return state
+
   def makeObservation(self, index):
-    state = self.deepCopy()
+    # Everything is observable in this contest, so a snapshot that has not been
+    # changed by push can be handed out as it is
+    if getattr(self, '_isSnapshot', False) and not getattr(self, '_undoStack', None):
+      return self
+    state = self.snapshot()
 
     # ***BEGIN REMOVED FOR CONTEST 2***
     # # Adds the sonar signal
@@ -338,6 +422,9 @@ class GameState:
       return configOrPos.pos[0] < width / 2
 
 def halfGrid(grid, red):
+  if isinstance(grid, BitGrid):
+    return grid.halfMask(left = red)
+
   halfway = grid.width // 2
   halfgrid = Grid(grid.width, grid.height, False)
   if red:    xrange = list(range(halfway))
@@ -357,6 +444,64 @@ def halfList(l, grid, red):
     elif not red and x > halfway: newList.append((x,y))
   return newList
 
+def teamFood(data, red):
+  """
+  Returns the read-only half of data.food that red (or blue) defends.  Both
+  halves are cached on data, shared with its successors and kept up to date by
+  setFood, so they are only rebuilt if the food grid is replaced another way.
+  """
+  cache = data._teamFood
+  if cache is None or cache[0] is not data.food:
+    food = data.food
+    if not isinstance(food, BitGrid): food = BitGrid.fromGrid(food)
+    cache = (data.food, halfGrid(food, red = False).freeze(), halfGrid(food, red = True).freeze())
+    data._teamFood = cache
+  if red: return cache[2]
+  return cache[1]
+
+def setFood(data, x, y, hasFood):
+  """
+  Sets food[x][y] on a copy of data.food (food grids are shared between states)
+  and updates the cached half of the grid that contains (x,y).
+  """
+  food = data.food.copy()
+  food[x][y] = hasFood
+  cache = data._teamFood
+  if cache is not None and cache[0] is data.food:
+    blue, red = cache[1], cache[2]
+    isRed = x < food.width // 2
+    half = (red if isRed else blue).copy()
+    half[x][y] = hasFood
+    half.freeze()
+    if isRed: red = half
+    else: blue = half
+    data._teamFood = (food, blue, red)
+  data.food = food
+
+def teamCapsules(data, red):
+  """
+  Returns a tuple of the capsules red (or blue) defends, cached like teamFood.
+  """
+  cache = data._teamCapsules
+  if cache is None or cache[0] is not data.capsules:
+    cache = (data.capsules, tuple(halfList(data.capsules, data.food, red = False)),
+             tuple(halfList(data.capsules, data.food, red = True)))
+    data._teamCapsules = cache
+  if red: return cache[2]
+  return cache[1]
+
+def removeCapsule(data, position):
+  """
+  Removes a capsule from a copy of data.capsules and from the cached halves.
+  """
+  capsules = data.capsules[:]
+  capsules.remove(position)
+  cache = data._teamCapsules
+  if cache is not None and cache[0] is data.capsules:
+    data._teamCapsules = (capsules, tuple(c for c in cache[1] if c != position),
+                          tuple(c for c in cache[2] if c != position))
+  data.capsules = capsules
+
 ############################################################################
 #                     THE HIDDEN SECRETS OF PACMAN                         #
 #                                                                          #
@@ -462,9 +607,15 @@ class AgentRules:
     """
     Returns a list of legal actions (which are both possible & allowed)
     """
-    agentState = state.getAgentState(agentIndex)
+    agentState = state.data.agentStates[agentIndex]
     conf = agentState.configuration
-    possibleActions = Actions.getPossibleActions( conf, state.data.layout.walls )
+    # Grid points use the layout's precomputed table; agents between grid points
+    # (or anywhere the table does not cover) fall back to the general rule
+    possibleActions = state.data.layout.legalActions.get( conf.pos )
+    if possibleActions is None:
+      possibleActions = Actions.getPossibleActions( conf, state.data.layout.walls )
+    else:
+      possibleActions = list( possibleActions )
     return AgentRules.filterForAllowedActions( agentState, possibleActions)
   getLegalActions = staticmethod( getLegalActions )
 
@@ -477,17 +628,31 @@ class AgentRules:
     """
     Edits the state to reflect the results of the action.
     """
-    legal = AgentRules.getLegalActions( state, agentIndex )
-    if action not in legal:
-      raise Exception("Illegal action " + str(action))
+    # Grid points use the layout's precomputed successor cells; agents between
+    # grid points (or anywhere the table does not cover) use the general rule
+    oldConfig = state.data.agentStates[agentIndex].configuration
+    moves = state.data.layout.legalMoves.get( oldConfig.pos )
+    if moves is None:
+      legal = AgentRules.getLegalActions( state, agentIndex )
+      if action not in legal:
+        raise Exception("Illegal action " + str(action))
+      speed = 1.0
+      # if agentState.isPacman: speed = 0.5
+      vector = Actions.directionToVector( action, speed )
+      newConfig = oldConfig.generateSuccessor( vector )
+    else:
+      for move, nextPos in moves:
+        if move == action: break
+      else:
+        raise Exception("Illegal action " + str(action))
+      direction = action
+      if direction == Directions.STOP:
+        direction = oldConfig.direction # There is no stop direction
+      newConfig = Configuration( nextPos, direction )
 
     # Update Configuration
-    agentState = state.data.agentStates[agentIndex]
-    speed = 1.0
-    # if agentState.isPacman: speed = 0.5
-    vector = Actions.directionToVector( action, speed )
-    oldConfig = agentState.configuration
-    agentState.configuration = oldConfig.generateSuccessor( vector )
+    agentState = state.data.writableAgentState(agentIndex)
+    agentState.configuration = newConfig
 
     # Eat
     next = agentState.configuration.getPosition()
@@ -537,16 +702,15 @@ class AgentRules:
         teamIndicesFunc = state.getRedTeamIndices
 
       # go increase the variable for the pacman who ate this
-      agents = [state.data.agentStates[agentIndex] for agentIndex in teamIndicesFunc()]
-      for agent in agents:
-        if agent.getPosition() == position:
-          agent.numCarrying += 1
+      for agentIndex in teamIndicesFunc():
+        if state.data.agentStates[agentIndex].getPosition() == position:
+          state.data.writableAgentState(agentIndex).numCarrying += 1
           break # the above should only be true for one agent...
 
       # do all the score and food grid maintainenace
       #state.data.scoreChange += score
-      state.data.food = state.data.food.copy()
-      state.data.food[x][y] = False
+      setFood(state.data, x, y, False)
+      state.data.toggleZobrist('food', x, y)
       state.data._foodEaten = position
       #if (isRed and state.getBlueFood().count() == MIN_FOOD) or (not isRed and state.getRedFood().count() == MIN_FOOD):
       #  state.data._win = True
@@ -555,21 +719,23 @@ class AgentRules:
     if isRed: myCapsules = state.getBlueCapsules()
     else: myCapsules = state.getRedCapsules()
     if( position in myCapsules ):
-      state.data.capsules.remove( position )
+      removeCapsule(state.data, position)
+      state.data.toggleZobrist('capsule', position[0], position[1])
       state.data._capsuleEaten = position
 
       # Reset all ghosts' scared timers
       if isRed: otherTeam = state.getBlueTeamIndices()
       else: otherTeam = state.getRedTeamIndices()
       for index in otherTeam:
-        state.data.agentStates[index].scaredTimer = SCARED_TIME
+        state.data.writableAgentState(index).scaredTimer = SCARED_TIME
 
   consume = staticmethod( consume )
 
   def decrementTimer(state):
     timer = state.scaredTimer
     if timer == 1:
-      state.configuration.pos = nearestPoint( state.configuration.pos )
+      # Configurations are shared between states, so replace rather than edit
+      state.configuration = Configuration( nearestPoint( state.configuration.pos ), state.configuration.direction )
     state.scaredTimer = max( 0, timer - 1 )
   decrementTimer = staticmethod( decrementTimer )
 
@@ -636,7 +802,6 @@ class AgentRules:
       return True
 
     numToDump = agentState.numCarrying
-    state.data.food = state.data.food.copy()
     foodAdded = []
 
     def genSuccessors(x, y):
@@ -660,7 +825,8 @@ class AgentRules:
       x = int(x)
       y = int(y)
       if (allGood(state, x, y)):
-        state.data.food[x][y] = True
+        setFood(state.data, x, y, True)
+        state.data.toggleZobrist('food', x, y)
         foodAdded.append((x, y))
         numToDump -= 1
 
@@ -675,7 +841,7 @@ class AgentRules:
   dumpFoodFromDeath = staticmethod(dumpFoodFromDeath)
 
   def checkDeath( state, agentIndex):
-    agentState = state.data.agentStates[agentIndex]
+    agentState = state.data.writableAgentState(agentIndex)
     if state.isOnRedTeam(agentIndex):
       otherTeam = state.getBlueTeamIndices()
     else:
@@ -688,6 +854,7 @@ class AgentRules:
         if ghostPosition == None: continue
         if manhattanDistance( ghostPosition, agentState.getPosition() ) <= COLLISION_TOLERANCE:
           # award points to the other team for killing Pacmen
+          otherAgentState = state.data.writableAgentState(index)
           if otherAgentState.scaredTimer <= 0:
             AgentRules.dumpFoodFromDeath(state, agentState, agentIndex)
 
@@ -714,6 +881,7 @@ class AgentRules:
         if pacPos == None: continue
         if manhattanDistance( pacPos, agentState.getPosition() ) <= COLLISION_TOLERANCE:
           #award points to the other team for killing Pacmen
+          otherAgentState = state.data.writableAgentState(index)
           if agentState.scaredTimer <= 0:
             AgentRules.dumpFoodFromDeath(state, otherAgentState, agentIndex)
 
@@ -51,6 +51,15 @@ class CaptureAgent(Agent):
   Recommended Usage:  Subclass CaptureAgent and override chooseAction.
   """
 
+  # How self.distancer gets maze distances (see distanceCalculator.Distancer):
+  # EAGER computes them all in registerInitialState, LAZY computes the distances
+  # from a cell when they are first needed (keeping at most distanceCacheBytes
+  # of them), HYBRID is LAZY except for the cells getEagerDistanceCells lists and
+  # JUNCTION only computes the distances between junctions.  Subclasses can
+  # override these.
+  distanceMode = distanceCalculator.EAGER
+  distanceCacheBytes = distanceCalculator.LAZY_CACHE_BYTES
+
   #############################
   # Methods to store key info #
   #############################
@@ -79,6 +88,9 @@ class CaptureAgent(Agent):
     # Maze distance calculator
     self.distancer = None
 
+    # Static maps of the maze's shape (layout.Topology)
+    self.topology = None
+
     # A history of observations
     self.observationHistory = []
 
@@ -99,15 +111,30 @@ class CaptureAgent(Agent):
     self.distancer.getDistance(p1, p2)
     """
     self.red = gameState.isOnRedTeam(self.index)
-    self.distancer = distanceCalculator.Distancer(gameState.data.layout)
+    eagerCells = ()
+    if self.distanceMode == distanceCalculator.HYBRID:
+      eagerCells = self.getEagerDistanceCells(gameState)
+    self.distancer = distanceCalculator.Distancer(gameState.data.layout, mode = self.distanceMode,
+                                                  maxBytes = self.distanceCacheBytes, eagerCells = eagerCells)
 
     # comment this out to forgo maze distance computation and use manhattan distances
     self.distancer.getMazeDistances()
+    self.topology = gameState.data.layout.getTopology()
 
     import __main__
     if '_display' in dir(__main__):
       self.display = __main__._display
 
+  def getEagerDistanceCells(self, gameState):
+    """
+    The cells whose distances a HYBRID distancer computes up front: the open
+    cells along this team's side of the border and every food pellet.
+    """
+    layout = gameState.data.layout
+    x = layout.width // 2 - 1 if self.red else layout.width // 2
+    border = [(x, y) for y in range(layout.height) if not layout.walls[x][y]]
+    return border + layout.food.asList()
+
   def final(self, gameState):
     self.observationHistory = []
 
@@ -247,6 +274,99 @@ class CaptureAgent(Agent):
     d = self.distancer.getDistance(pos1, pos2)
     return d
 
+  def getMazeDistancesFrom(self, pos, targets):
+    """
+    Returns the distances from pos to each of targets in one call, as a NumPy
+    array (a list if NumPy is not installed).  See Distancer.distancesFrom.
+    """
+    return self.distancer.distancesFrom(pos, targets)
+
+  def getNearest(self, pos, targets):
+    """
+    Returns (target, distance) for the one of targets closest to pos, or None
+    if targets is empty, e.g. self.getNearest(myPos, foodList)[1] instead of
+    min([self.getMazeDistance(myPos, food) for food in foodList]).
+    """
+    return self.distancer.nearest(pos, targets)
+
+  def getMinDistanceMatrix(self, sources, targets):
+    """
+    Returns the distances from every one of sources to every one of targets as
+    a len(sources) x len(targets) array.  See Distancer.minDistanceMatrix.
+    """
+    return self.distancer.minDistanceMatrix(sources, targets)
+
+  def getNextStep(self, pos, target):
+    """
+    Returns the action that starts a shortest path from pos to target, without
+    generating any successors.  See Distancer.nextStep.
+    """
+    return self.distancer.nextStep(pos, target)
+
+  def getAllShortestFirstMoves(self, pos, target):
+    """
+    Returns all the actions from pos that start a shortest path to target.
+    """
+    return self.distancer.allShortestFirstMoves(pos, target)
+
+  def getMazePath(self, pos, target):
+    """
+    Returns the cells of a shortest path from pos to target, both included.
+    """
+    return self.distancer.getPath(pos, target)
+
+  def getJunctionGraph(self):
+    """
+    Returns the maze as a graph of junctions and corridors (see
+    distanceCalculator.JunctionGraph), e.g. to search over junctions only.
+    """
+    return self.distancer.getJunctionGraph()
+
+  def getDistanceToHome(self, pos, isRed = None):
+    """
+    Returns the maze distance from pos to the nearest cell of this team's side
+    of the border (of the red or blue side if isRed is given).  These are
+    precomputed for every cell, so this is a lookup.
+    """
+    if isRed == None: isRed = self.red
+    return self.distancer.getDistanceToHome(pos, isRed)
+
+  def getNearestHomeCell(self, pos, isRed = None):
+    """
+    Returns the cell of this team's side of the border (of the red or blue
+    side if isRed is given) that getDistanceToHome measures to.
+    """
+    if isRed == None: isRed = self.red
+    return self.distancer.getNearestHomeCell(pos, isRed)
+
+  def isChokepoint(self, pos):
+    """
+    Whether pos is an articulation point of the maze: a cell that, if blocked,
+    cuts the maze in two.
+    """
+    return self.topology.isArticulationPoint(pos)
+
+  def getDeadEndDepth(self, pos):
+    """
+    How many steps pos lies inside a pocket of the maze (see getPocketExit);
+    0 for cells that are in no pocket.
+    """
+    return self.topology.getDeadEndDepth(pos)
+
+  def getPocketExit(self, pos):
+    """
+    If pos lies in a pocket (a region with a single way out), returns the cell
+    that is the only way out of it; otherwise returns None.
+    """
+    return self.topology.getPocketExit(pos)
+
+  def getBorderCrossings(self):
+    """
+    The cells on this team's side of the border from which an agent can step
+    straight across it.
+    """
+    return self.topology.getBorderCrossings(self.red)
+
   def getPreviousObservation(self):
     """
     Returns the GameState object corresponding to the last state this agent saw
@@ -0,0 +1,110 @@
+# checkBatchCapture.py
+# --------------------
+# Licensing Information:  You are free to use or extend these projects for
+# educational purposes provided that (1) you do not distribute or publish
+# solutions, (2) you retain this notice, and (3) you provide clear
+# attribution to UC Berkeley, including a link to http://ai.berkeley.edu.
+#
+# Attribution Information: The Pacman AI projects were developed at UC Berkeley.
+# The core projects and autograders were primarily created by John DeNero
+# (denero@cs.berkeley.edu) and Dan Klein (klein@cs.berkeley.edu).
+# Student side autograding was added by Brad Miller, Nick Hay, and
+# Pieter Abbeel (pabbeel@cs.berkeley.edu).
+
+"""
+Checks batchCapture.BatchGames against the scalar engine move by move:
+
+  > python checkBatchCapture.py -n 20 defaultCapture jumboCapture RANDOM7
+
+Each batch game is shadowed by a GameState driven with the same actions
+through generateSuccessor.  After every move the legal actions, the agents,
+the food, the capsules, the score, the time left, the Zobrist key and whether
+the game is over must all agree.  The random actions favour moving over
+stopping so that games see captures, deaths and food dropped on death.
+"""
+
+import sys
+import capture
+import layout as layoutModule
+from batchCapture import BatchGames, ACTIONS, STOP
+import numpy
+
+def checkLayout(layout, numGames, length, seed):
+  """
+  Plays numGames random games on layout both ways and raises an Exception at
+  the first difference.  Returns counts of the moves, food dumps on death,
+  capsules eaten and wins seen.
+  """
+  random = numpy.random.RandomState(seed)
+  starts = random.randint(2, size = numGames)
+  games = BatchGames(layout, numGames, length, starts)
+  states = []
+  for i in range(numGames):
+    state = capture.GameState()
+    state.initialize(layout, 4)
+    state.data.timeleft = length
+    states.append(state)
+  toMove = list(starts)
+  done = [False] * numGames
+  numMoves = [0] * numGames
+  events = {'moves': 0, 'dumps': 0, 'capsules': 0, 'wins': 0}
+  while not games.done.all():
+    legal = games.getLegalActions()
+    preference = random.random_sample(legal.shape) + (numpy.arange(len(ACTIONS)) != STOP) * 0.5
+    choice = numpy.where(legal, preference, -1).argmax(axis = 1)
+    for i in range(numGames):
+      if done[i]: continue
+      state = states[i]
+      scalarLegal = sorted(state.getLegalActions(toMove[i]))
+      if scalarLegal != sorted(ACTIONS[k] for k in numpy.nonzero(legal[i])[0]):
+        raise Exception('Game %d: legal actions differ after %d moves' % (i, numMoves[i]))
+      state = state.generateSuccessor(toMove[i], ACTIONS[choice[i]])
+      events['moves'] += 1
+      if state.data._foodAdded: events['dumps'] += 1
+      if state.data._capsuleEaten: events['capsules'] += 1
+      if state.data._win: events['wins'] += 1
+      states[i] = state
+      numMoves[i] += 1
+      done[i] = state.data._win or numMoves[i] == length
+      toMove[i] = (toMove[i] + 1) % 4
+    games.stepAgent(choice)
+    for i in range(numGames):
+      compareStates(states[i], games.getGameState(i), 'Game %d after %d moves' % (i, numMoves[i]))
+      if done[i] != bool(games.done[i]):
+        raise Exception('Game %d after %d moves: done differs' % (i, numMoves[i]))
+  return events
+
+def compareStates(scalar, batch, where):
+  for index in range(4):
+    a, b = scalar.data.agentStates[index], batch.data.agentStates[index]
+    if (a.configuration.pos, a.configuration.direction) != (b.configuration.pos, b.configuration.direction):
+      raise Exception('%s: agent %d is at %s, batch says %s' % (where, index, a.configuration, b.configuration))
+    if (a.isPacman, a.scaredTimer, a.numCarrying, a.numReturned) != (b.isPacman, b.scaredTimer, b.numCarrying, b.numReturned):
+      raise Exception('%s: agent %d differs' % (where, index))
+  if scalar.data.food != batch.data.food:
+    raise Exception('%s: food differs' % where)
+  if list(scalar.data.capsules) != list(batch.data.capsules):
+    raise Exception('%s: capsules differ' % where)
+  if (scalar.data.score, scalar.data.timeleft) != (batch.data.score, batch.data.timeleft):
+    raise Exception('%s: score or time left differs' % where)
+  if scalar.key() != batch.key():
+    raise Exception('%s: Zobrist keys differ' % where)
+
+if __name__ == '__main__':
+  from optparse import OptionParser
+  parser = OptionParser('python checkBatchCapture.py [-n GAMES] [-i LENGTH] [LAYOUT|RANDOM<seed> ...]')
+  parser.add_option('-n', '--numGames', type = 'int', dest = 'numGames', default = 20)
+  parser.add_option('-i', '--time', type = 'int', dest = 'time', default = 1200)
+  parser.add_option('--fixRandomSeed', type = 'int', dest = 'seed', default = 1)
+  options, names = parser.parse_args(sys.argv[1:])
+  if not names:
+    names = ['defaultCapture', 'jumboCapture', 'tinyCapture', 'fastCapture', 'RANDOM7', 'RANDOM21']
+  for name in names:
+    if name.startswith('RANDOM'):
+      layout = layoutModule.Layout(capture.randomLayout(int(name[6:])).split('\n'))
+    else:
+      layout = layoutModule.getLayout(name)
+    if layout is None: raise Exception("The layout " + name + " cannot be found")
+    events = checkLayout(layout, options.numGames, options.time, options.seed)
+    print('%s: %d moves match (%d food dumps, %d capsules eaten, %d wins)' % (
+      name, events['moves'], events['dumps'], events['capsules'], events['wins']))
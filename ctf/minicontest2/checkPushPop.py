@@ -0,0 +1,93 @@
+# checkPushPop.py
+# ---------------
+# Licensing Information:  You are free to use or extend these projects for
+# educational purposes provided that (1) you do not distribute or publish
+# solutions, (2) you retain this notice, and (3) you provide clear
+# attribution to UC Berkeley, including a link to http://ai.berkeley.edu.
+#
+# Attribution Information: The Pacman AI projects were developed at UC Berkeley.
+# The core projects and autograders were primarily created by John DeNero
+# (denero@cs.berkeley.edu) and Dan Klein (klein@cs.berkeley.edu).
+# Student side autograding was added by Brad Miller, Nick Hay, and
+# Pieter Abbeel (pabbeel@cs.berkeley.edu).
+
+"""
+Checks that GameState.push and pop give exactly the states generateSuccessor
+does, over random playouts on every layout in layouts/:
+
+  > python checkPushPop.py -n 2 -t 600
+
+At every step of a playout, each legal action (and each legal reply to it) is
+both pushed and generated as a successor, and the two states are compared, as
+is the state after popping back.  The playout itself moves on by push or by
+generateSuccessor at random, so pushes are also checked on top of successors
+and the other way round.
+"""
+
+import os, sys, random
+import capture
+import layout as layoutModule
+
+def stateSummary(state):
+  "Everything about a state that the rules read or write"
+  data = state.data
+  agents = tuple((a.configuration.pos, a.configuration.direction, a.isPacman, a.scaredTimer,
+                  a.numCarrying, a.numReturned) for a in data.agentStates)
+  return (agents, sorted(data.food.asList()), list(data.capsules), data.score, data._win,
+          data._foodEaten, data._foodAdded, data._capsuleEaten, data.timeleft, state.key())
+
+def checkPlayout(layout, numSteps, seed):
+  """
+  Plays numSteps random moves on layout and raises an Exception at the first
+  difference between push and generateSuccessor.  Returns the number of
+  states compared.
+  """
+  random.seed(seed)
+  state = capture.GameState()
+  state.initialize(layout, 4)
+  state.data.timeleft = numSteps
+  numCompared = 0
+  agentIndex = 0
+  for step in range(numSteps):
+    before = stateSummary(state)
+    nextIndex = (agentIndex + 1) % 4
+    for action in state.getLegalActions(agentIndex):
+      successor = state.generateSuccessor(agentIndex, action)
+      state.push(agentIndex, action)
+      if stateSummary(state) != stateSummary(successor):
+        raise Exception('push(%d, %s) differs from generateSuccessor at step %d' % (agentIndex, action, step))
+      for reply in state.getLegalActions(nextIndex):
+        replySuccessor = successor.generateSuccessor(nextIndex, reply)
+        state.push(nextIndex, reply)
+        if stateSummary(state) != stateSummary(replySuccessor):
+          raise Exception('push(%d, %s) after %s differs from generateSuccessor at step %d' % (nextIndex, reply, action, step))
+        state.pop()
+        numCompared += 1
+      state.pop()
+      numCompared += 1
+      if stateSummary(state) != before:
+        raise Exception('pop after push(%d, %s) did not restore the state at step %d' % (agentIndex, action, step))
+    action = random.choice(state.getLegalActions(agentIndex))
+    if random.random() < 0.5:
+      state.push(agentIndex, action)
+    else:
+      state = state.generateSuccessor(agentIndex, action)
+    agentIndex = nextIndex
+  return numCompared
+
+if __name__ == '__main__':
+  from optparse import OptionParser
+  parser = OptionParser('python checkPushPop.py [-n PLAYOUTS] [-t STEPS] [LAYOUT ...]')
+  parser.add_option('-n', '--numPlayouts', type = 'int', dest = 'numPlayouts', default = 2)
+  parser.add_option('-t', '--steps', type = 'int', dest = 'steps', default = 600)
+  options, names = parser.parse_args(sys.argv[1:])
+  if not names:
+    names = sorted(name for name in os.listdir('layouts') if name.endswith('.lay'))
+  total = 0
+  for name in names:
+    layout = layoutModule.getLayout(name)
+    if layout is None: raise Exception("The layout " + name + " cannot be found")
+    numCompared = sum(checkPlayout(layout, options.steps, seed) for seed in range(options.numPlayouts))
+    print('%s: %d states match' % (name, numCompared))
+    total += numCompared
+  print('push/pop matches generateSuccessor on all %d states' % total)
@@ -22,6 +22,7 @@
 
 from util import *
 import time, os
+import hashlib
 import traceback
 import sys
 
@@ -75,6 +76,7 @@ class Configuration:
     The convention for positions, like a graph, is that (0,0) is the lower left corner, x increases
     horizontally and y increases vertically.  Therefore, north is the direction of increasing y, or (0,1).
     """
+    __slots__ = ('pos', 'direction')
 
     def __init__(self, pos, direction):
         self.pos = pos
@@ -121,6 +123,7 @@ class AgentState:
     """
     AgentStates hold the state of an agent (configuration, speed, scared, etc).
     """
+    __slots__ = ('start', 'configuration', 'isPacman', 'scaredTimer', 'numCarrying', 'numReturned')
 
     def __init__( self, startConfiguration, isPacman ):
         self.start = startConfiguration
@@ -280,6 +283,217 @@ def reconstituteGrid(bitRep):
     width, height = bitRep[:2]
     return Grid(width, height, bitRepresentation= bitRep[2:])
 
+class BitGrid:
+    """
+    A boolean Grid backed by a single arbitrary-precision int.  Cell (x,y) is
+    bit x * height + y, so every column is a contiguous run of bits and the
+    integer is the same one Grid.__hash__ builds.
+
+    Data is still accessed via grid[x][y], but copies, equality, hashing and
+    counting no longer loop over every cell in Python, and grids can be
+    combined with the bitwise operators |, & and -.
+    """
+    def __init__(self, width, height, initialValue=False, bits=0):
+        if initialValue not in [False, True]: raise Exception('Grids can only contain booleans')
+        self.width = width
+        self.height = height
+        self.mask = (1 << (width * height)) - 1
+        if initialValue:
+            bits = self.mask
+        self.bits = bits
+        self.readOnly = False
+        self._count = None
+        self._list = None
+        self._columns = None
+
+    def _new(self, bits):
+        g = BitGrid.__new__(BitGrid)
+        g.width = self.width
+        g.height = self.height
+        g.mask = self.mask
+        g.bits = bits
+        g.readOnly = False
+        g._count = None
+        g._list = None
+        g._columns = None
+        return g
+
+    def freeze(self):
+        """
+        Makes the grid read-only and returns it.  Writing to a frozen grid raises
+        an exception (copy() it first); in exchange count() and asList() are
+        only computed once, and grid[x] is a tuple of bools that is built the
+        first time column x is read, so grid[x][y] is as quick as on a Grid.
+        """
+        self.readOnly = True
+        return self
+
+    def __getitem__(self, x):
+        columns = self._columns
+        if columns is None:
+            if not self.readOnly:
+                if x < 0: x += self.width
+                if x < 0 or x >= self.width: raise IndexError('grid column out of range')
+                return _BitColumn(self, x * self.height)
+            columns = self._columns = [None] * self.width
+        column = columns[x]
+        if column is None:
+            column = columns[x] = tuple(_BitColumn(self, (x % self.width) * self.height))
+        return column
+
+    def __setitem__(self, x, column):
+        for y, value in enumerate(column):
+            self[x][y] = value
+
+    def __iter__(self):
+        for x in range(self.width):
+            yield self[x]
+
+    def __str__(self):
+        out = [[str(self[x][y])[0] for x in range(self.width)] for y in range(self.height)]
+        out.reverse()
+        return '\n'.join([''.join(x) for x in out])
+
+    def __eq__(self, other):
+        if other == None: return False
+        if isinstance(other, BitGrid):
+            return self.bits == other.bits and self.height == other.height
+        return self.data == other.data
+
+    def __hash__(self):
+        return hash(self.bits)
+
+    def __or__(self, other):
+        return self._new(self.bits | other.bits)
+
+    def __and__(self, other):
+        return self._new(self.bits & other.bits)
+
+    def __sub__(self, other):
+        return self._new(self.bits & ~other.bits)
+
+    def __invert__(self):
+        return self._new(self.mask & ~self.bits)
+
+    def union(self, other):
+        return self | other
+
+    def intersection(self, other):
+        return self & other
+
+    def columnMask(self, start, stop):
+        """
+        Returns a copy of the grid that only keeps the columns start <= x < stop.
+        """
+        start = max(0, start)
+        stop = min(self.width, stop)
+        if stop <= start: return self._new(0)
+        span = ((1 << ((stop - start) * self.height)) - 1) << (start * self.height)
+        return self._new(self.bits & span)
+
+    def halfMask(self, left):
+        """
+        Returns the left (x < width // 2) or right half of the grid.
+        """
+        halfway = self.width // 2
+        if left: return self.columnMask(0, halfway)
+        return self.columnMask(halfway, self.width)
+
+    def copy(self):
+        return self._new(self.bits)
+
+    def deepCopy(self):
+        return self.copy()
+
+    def shallowCopy(self):
+        return self.copy()
+
+    def count(self, item =True ):
+        setBits = self._count
+        if setBits is None:
+            setBits = bin(self.bits).count('1')
+            if self.readOnly: self._count = setBits
+        if item: return setBits
+        return self.width * self.height - setBits
+
+    def indices(self, key = True):
+        """
+        Iterates over the bit indices (x * height + y) whose cell equals key.
+        """
+        bits = self.bits if key else self.mask & ~self.bits
+        while bits:
+            low = bits & -bits
+            yield low.bit_length() - 1
+            bits ^= low
+
+    def iterSet(self, key = True):
+        """
+        Iterates over the (x,y) positions whose cell equals key, in asList order.
+        """
+        height = self.height
+        for i in self.indices(key):
+            yield divmod(i, height)
+
+    def asList(self, key = True):
+        if not (key and self.readOnly): return list(self.iterSet(key))
+        if self._list is None:
+            self._list = tuple(self.iterSet())
+        return list(self._list)
+
+    @property
+    def data(self):
+        """
+        A list of lists with the same layout as Grid.data, for code that reads it directly.
+        """
+        return [list(self[x]) for x in range(self.width)]
+
+    @staticmethod
+    def fromGrid(grid):
+        g = BitGrid(grid.width, grid.height)
+        for x, y in grid.asList():
+            g[x][y] = True
+        return g
+
+class _BitColumn:
+    """
+    A view of one BitGrid column, so that grid[x][y] reads and writes bits.
+    """
+    __slots__ = ('grid', 'offset')
+
+    def __init__(self, grid, offset):
+        self.grid = grid
+        self.offset = offset
+
+    def __getitem__(self, y):
+        height = self.grid.height
+        if y < 0: y += height
+        if y < 0 or y >= height: raise IndexError('grid row out of range')
+        return (self.grid.bits >> (self.offset + y)) & 1 == 1
+
+    def __setitem__(self, y, value):
+        if self.grid.readOnly: raise Exception('This grid is read-only; copy() it first')
+        height = self.grid.height
+        if y < 0: y += height
+        if y < 0 or y >= height: raise IndexError('grid row out of range')
+        if value:
+            self.grid.bits |= 1 << (self.offset + y)
+        else:
+            self.grid.bits &= ~(1 << (self.offset + y))
+
+    def __len__(self):
+        return self.grid.height
+
+    def __iter__(self):
+        column = self.grid.bits >> self.offset
+        for y in range(self.grid.height):
+            yield (column >> y) & 1 == 1
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def count(self, item=True):
+        return list(self).count(item)
+
 ####################################
 # Parts you shouldn't have to read #
 ####################################
@@ -372,16 +586,29 @@ class GameStateData:
     """
 
     """
+    __slots__ = ('food', 'capsules', 'agentStates', '_ownedAgentStates', 'layout', '_eaten',
+                 'score', 'scoreChange', 'timeleft', '_foodEaten', '_foodAdded', '_capsuleEaten',
+                 '_agentMoved', '_lose', '_win', '_zobrist', '_teamFood', '_teamCapsules')
     def __init__( self, prevState = None ):
         """
         Generates a new data packet by copying information from its predecessor.
         """
         if prevState != None:
-            self.food = prevState.food.shallowCopy()
-            self.capsules = prevState.capsules[:]
-            self.agentStates = self.copyAgentStates( prevState.agentStates )
+            # Successors share the food grid, the capsule list and every
+            # AgentState with their predecessor.  The rules replace the food
+            # grid and capsule list before changing them, and both states go
+            # through writableAgentState before changing an agent, so neither
+            # owns the AgentStates they now share.
+            self.food = prevState.food
+            self.capsules = prevState.capsules
+            self.agentStates = prevState.agentStates[:]
+            self._ownedAgentStates = [False for a in self.agentStates]
+            prevState._ownedAgentStates = [False for a in self.agentStates]
             self.layout = prevState.layout
             self._eaten = prevState._eaten
+            self._zobrist = prevState._zobrist
+            self._teamFood = prevState._teamFood
+            self._teamCapsules = prevState._teamCapsules
             self.score = prevState.score
 
         self._foodEaten = None
@@ -393,9 +620,29 @@ class GameStateData:
         self.scoreChange = 0
 
     def deepCopy( self ):
+        return self._copyWithFood( self.food.deepCopy() )
+
+    def snapshot( self ):
+        """
+        Returns a copy that is cheap enough to hand to an agent every turn.  The
+        AgentStates and the capsule list are copied as in deepCopy, but the food
+        grid is a frozen BitGrid copy, which shares its bits instead of copying
+        every cell (agents get an error if they try to change it).
+        """
+        food = self.food.copy()
+        if isinstance(food, BitGrid): food.freeze()
+        state = self._copyWithFood( food )
+        if self._teamFood is not None and self._teamFood[0] is self.food:
+            # The cached halves are read-only already, so they can be shared
+            state._teamFood = (food,) + self._teamFood[1:]
+        return state
+
+    def _copyWithFood( self, food ):
         state = GameStateData( self )
-        state.food = self.food.deepCopy()
-        state.layout = self.layout.deepCopy()
+        state.food = food
+        state.capsules = self.capsules[:]
+        state.agentStates = self.copyAgentStates( self.agentStates )
+        state._ownedAgentStates = [True for a in state.agentStates]
         state._agentMoved = self._agentMoved
         state._foodEaten = self._foodEaten
         state._foodAdded = self._foodAdded
@@ -408,6 +655,95 @@ class GameStateData:
             copiedStates.append( agentState.copy() )
         return copiedStates
 
+    def writableAgentState( self, index ):
+        """
+        Returns agentStates[index] for modification, first replacing it with a
+        private copy if it is still shared with the predecessor state.
+        """
+        if not self._ownedAgentStates[index]:
+            self.agentStates[index] = self.agentStates[index].copy()
+            self._ownedAgentStates[index] = True
+        return self.agentStates[index]
+
+    def beginUndoableMove( self ):
+        """
+        Prepares this data for a move applied in place (see GameState.push in
+        capture.py).  Resets the per-move bookkeeping the way the constructor
+        does for a successor and returns a record for undoMove.
+
+        Every AgentState becomes shared again, so the move copies what it changes
+        and the objects referenced by the record are never modified.
+        """
+        record = (self.agentStates, self.food, self.capsules,
+                  self.score, self.scoreChange, self.timeleft, self._agentMoved,
+                  self._foodEaten, self._foodAdded, self._capsuleEaten, self._lose, self._win,
+                  self._zobrist, self._teamFood, self._teamCapsules)
+        self.agentStates = self.agentStates[:]
+        self._ownedAgentStates = [False for a in self.agentStates]
+        self._foodEaten = None
+        self._foodAdded = None
+        self._capsuleEaten = None
+        self._agentMoved = None
+        self._lose = False
+        self._win = False
+        self.scoreChange = 0
+        return record
+
+    def undoMove( self, record ):
+        """
+        Restores the data to how it was when beginUndoableMove returned record.
+        The AgentStates stay shared, as states generated in between may hold them.
+        """
+        (self.agentStates, self.food, self.capsules,
+         self.score, self.scoreChange, self.timeleft, self._agentMoved,
+         self._foodEaten, self._foodAdded, self._capsuleEaten, self._lose, self._win,
+         self._zobrist, self._teamFood, self._teamCapsules) = record
+        self._ownedAgentStates = [False for a in self.agentStates]
+
+    def zobristKey( self ):
+        """
+        Returns a 64-bit Zobrist key of the agent configurations, scared timers
+        and carried food, the food, the capsules and the score.  The key is
+        maintained incrementally, so this is O(1).
+        """
+        return self._zobrist ^ zobristValue('score', self.score)
+
+    def computeZobristKey( self ):
+        """
+        Recomputes zobristKey() from scratch.
+        """
+        key = zobristValue('score', self.score)
+        for index, agentState in enumerate(self.agentStates):
+            key ^= agentZobrist(index, agentState)
+        for x, y in self.food.asList():
+            key ^= zobristValue('food', x, y)
+        for x, y in self.capsules:
+            key ^= zobristValue('capsule', x, y)
+        return key
+
+    def resetZobristKey( self ):
+        """
+        Recomputes the incremental key, after the data was edited directly.
+        """
+        self._zobrist = self.computeZobristKey() ^ zobristValue('score', self.score)
+
+    def toggleZobrist( self, *feature ):
+        """
+        Records that a food pellet or capsule, e.g. ('food', x, y), was added
+        or removed.
+        """
+        self._zobrist ^= zobristValue(*feature)
+
+    def updateAgentZobrist( self, previousAgentStates ):
+        """
+        Folds the agents changed by a move into the key, given the agentStates
+        list from before the move.
+        """
+        for index, owned in enumerate(self._ownedAgentStates):
+            if owned and self.agentStates[index] is not previousAgentStates[index]:
+                self._zobrist ^= agentZobrist(index, previousAgentStates[index])
+                self._zobrist ^= agentZobrist(index, self.agentStates[index])
+
     def __eq__( self, other ):
         """
         Allows two states to be compared.
@@ -490,7 +826,7 @@ class GameStateData:
         """
         self.food = layout.food.copy()
         #self.capsules = []
-        self.capsules = layout.capsules[:]
+        self.capsules = list(layout.capsules)
         self.layout = layout
         self.score = 0
         self.scoreChange = 0
@@ -502,7 +838,40 @@ class GameStateData:
                 if numGhosts == numGhostAgents: continue # Max ghosts reached already
                 else: numGhosts += 1
             self.agentStates.append( AgentState( Configuration( pos, Directions.STOP), isPacman) )
+        self._ownedAgentStates = [True for a in self.agentStates]
         self._eaten = [False for a in self.agentStates]
+        self.resetZobristKey()
+        self._teamFood = None
+        self._teamCapsules = None
+
+_ZOBRIST_VALUES = {}
+
+def zobristValue(*feature):
+    """
+    Returns the fixed pseudo-random 64-bit number that stands for one state
+    feature, e.g. ('food', x, y), in a Zobrist key.  The numbers are derived
+    from the feature itself, so keys agree across processes.
+    """
+    try:
+        return _ZOBRIST_VALUES[feature]
+    except KeyError:
+        digest = hashlib.blake2b(repr(feature).encode(), digest_size=8).digest()
+        value = _ZOBRIST_VALUES[feature] = int.from_bytes(digest, 'little')
+        return value
+
+def agentZobrist(index, agentState):
+    """
+    The part of a Zobrist key that describes the agent with the given index.
+    """
+    key = zobristValue('scared', index, agentState.scaredTimer)
+    key ^= zobristValue('carrying', index, agentState.numCarrying)
+    conf = agentState.configuration
+    if conf != None:
+        x, y = conf.pos
+        if x == int(x) and y == int(y):
+            x, y = int(x), int(y)
+        key ^= zobristValue('agent', index, x, y, conf.direction)
+    return key
 
 try:
     import boinc
@@ -564,6 +933,12 @@ class Game:
         sys.stderr = OLD_STDERR
 
 
+    def _snapshotState( self ):
+        "Returns a private copy of the current state to hand to an agent"
+        if hasattr(self.state, 'snapshot'):
+            return self.state.snapshot()
+        return self.state.deepCopy()
+
     def run( self ):
         """
         Main control loop for game play.
@@ -590,7 +965,7 @@ class Game:
                         timed_func = TimeoutFunction(agent.registerInitialState, int(self.rules.getMaxStartupTime(i)))
                         try:
                             start_time = time.time()
-                            timed_func(self.state.deepCopy())
+                            timed_func(self._snapshotState())
                             time_taken = time.time() - start_time
                             self.totalAgentTimes[i] += time_taken
                         except TimeoutFunctionException:
@@ -604,7 +979,7 @@ class Game:
                         self.unmute()
                         return
                 else:
-                    agent.registerInitialState(self.state.deepCopy())
+                    agent.registerInitialState(self._snapshotState())
                 ## TODO: could this exceed the total time
                 self.unmute()
 
@@ -624,7 +999,7 @@ class Game:
                         timed_func = TimeoutFunction(agent.observationFunction, int(self.rules.getMoveTimeout(agentIndex)))
                         try:
                             start_time = time.time()
-                            observation = timed_func(self.state.deepCopy())
+                            observation = timed_func(self._snapshotState())
                         except TimeoutFunctionException:
                             skip_action = True
                         move_time += time.time() - start_time
@@ -634,10 +1009,10 @@ class Game:
                         self.unmute()
                         return
                 else:
-                    observation = agent.observationFunction(self.state.deepCopy())
+                    observation = agent.observationFunction(self._snapshotState())
                 self.unmute()
             else:
-                observation = self.state.deepCopy()
+                observation = self._snapshotState()
 
             # Solicit an action
             action = None
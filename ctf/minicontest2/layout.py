@@ -14,28 +14,43 @@
 
 from util import manhattanDistance
 from game import Grid
+from game import BitGrid
+from game import Actions, Configuration, Directions
 import os
 import random
 from functools import reduce
 
 VISIBILITY_MATRIX_CACHE = {}
+LAYOUT_CACHE = {}
 
 class Layout:
     """
     A Layout manages the static information about the game board.
+
+    Layouts are immutable once constructed (the walls and food grids are frozen
+    and the capsules and agent positions are tuples), so one Layout is shared by
+    every state of every game played on it; see internLayout.  fromFile tells
+    the layouts read from layout files apart from generated ones.
     """
 
-    def __init__(self, layoutText):
+    def __init__(self, layoutText, fromFile = False):
         self.width = len(layoutText[0])
         self.height= len(layoutText)
-        self.walls = Grid(self.width, self.height, False)
-        self.food = Grid(self.width, self.height, False)
+        self.walls = BitGrid(self.width, self.height, False)
+        self.food = BitGrid(self.width, self.height, False)
         self.capsules = []
         self.agentPositions = []
         self.numGhosts = 0
         self.processLayoutText(layoutText)
-        self.layoutText = layoutText
-        self.totalFood = len(self.food.asList())
+        self.layoutText = tuple(layoutText)
+        self.walls.freeze()
+        self.food.freeze()
+        self.capsules = tuple(self.capsules)
+        self.agentPositions = tuple(self.agentPositions)
+        self.totalFood = self.food.count()
+        self.fromFile = fromFile
+        self._topology = None
+        self.initializeMoveTables()
         # self.initializeVisibilityMatrix()
 
     def getNumGhosts(self):
@@ -62,6 +77,35 @@ class Layout:
         else:
             self.visibility = VISIBILITY_MATRIX_CACHE[reduce(str.__add__, self.layoutText)]
 
+    def initializeMoveTables(self):
+        """
+        Precomputes, for every open cell, the actions Actions.getPossibleActions
+        allows from it (self.legalActions) and the (action, successor position)
+        pairs they lead to (self.legalMoves), the positions being exactly those
+        Actions.getSuccessor gives.  Both map an (x,y) grid point to a tuple.
+        """
+        self.legalActions = {}
+        self.legalMoves = {}
+        for x, y in self.walls.asList(False):
+            try:
+                actions = Actions.getPossibleActions(Configuration((x, y), Directions.STOP), self.walls)
+            except IndexError:
+                continue # Open cell on the border of the map; left to the slow path
+            self.legalActions[(x, y)] = tuple(actions)
+            moves = []
+            for action in actions:
+                moves.append((action, Actions.getSuccessor((x, y), action)))
+            self.legalMoves[(x, y)] = tuple(moves)
+
+    def getTopology(self):
+        """
+        The Topology of this layout's walls, computed the first time it is asked
+        for and kept for as long as the layout is.
+        """
+        if self._topology is None:
+            self._topology = Topology(self.walls)
+        return self._topology
+
     def isWall(self, pos):
         x, col = pos
         return self.walls[x][col]
@@ -91,7 +135,10 @@ class Layout:
         return "\n".join(self.layoutText)
 
     def deepCopy(self):
-        return Layout(self.layoutText[:])
+        """
+        Layouts are immutable, so copies share this one.
+        """
+        return self
 
     def processLayoutText(self, layoutText):
         """
@@ -129,6 +176,159 @@ class Layout:
         elif layoutChar in  ['1', '2', '3', '4']:
             self.agentPositions.append( (int(layoutChar), (x,y)))
             self.numGhosts += 1
+class Topology:
+    """
+    Static maps of the maze's shape, for agents that reason about traps and
+    crossings:
+
+      articulationPoints  the open cells whose removal disconnects the maze
+      pocketExits         {cell: exit} for every cell inside a pocket, a region
+                          that can only be left through its exit cell (an
+                          articulation point).  Pockets are as large as
+                          possible, measured from the biggest open area of the
+                          maze, so nested dead ends report their outermost exit.
+      pockets             {exit: cells of the pockets behind that exit}
+      deadEndDepths       {cell: maze distance to its pocket exit} for the cells
+                          in pockets; every other cell has depth 0
+      borderCrossings     {isRed: cells} the open cells of each side's border
+                          column that have an open neighbor across the border
+
+    Build one through Layout.getTopology, which caches it per wall grid.
+    """
+
+    def __init__(self, walls):
+        self.width = walls.width
+        self.height = walls.height
+        cells = walls.asList(False)
+        open = set(cells)
+        self.neighbors = {}
+        for x, y in cells:
+            adjacent = [(x,y+1), (x,y-1), (x+1,y), (x-1,y)]
+            self.neighbors[(x, y)] = [cell for cell in adjacent if cell in open]
+        self.articulationPoints = frozenset(self._findArticulationPoints(cells))
+        self.pocketExits = self._findPockets(cells)
+        self.pockets = {}
+        for cell, exit in self.pocketExits.items():
+            self.pockets.setdefault(exit, []).append(cell)
+        for exit in self.pockets:
+            self.pockets[exit] = tuple(sorted(self.pockets[exit]))
+        self.deadEndDepths = self._measurePockets()
+        self.borderCrossings = {}
+        for isRed in [True, False]:
+            x = self.width // 2 - 1 if isRed else self.width // 2
+            across = x + 1 if isRed else x - 1
+            self.borderCrossings[isRed] = tuple((x, y) for y in range(self.height)
+                                                if (x, y) in self.neighbors and (across, y) in self.neighbors[(x, y)])
+
+    def _depthFirst(self, root, disc, low, parent, order):
+        "Iterative Tarjan depth-first search from root, filling in its arguments"
+        disc[root] = low[root] = len(order)
+        order.append(root)
+        parent[root] = None
+        stack = [(root, iter(self.neighbors[root]))]
+        while stack:
+            cell, children = stack[-1]
+            advanced = False
+            for child in children:
+                if child not in disc:
+                    disc[child] = low[child] = len(order)
+                    order.append(child)
+                    parent[child] = cell
+                    stack.append((child, iter(self.neighbors[child])))
+                    advanced = True
+                    break
+                elif child != parent[cell]:
+                    low[cell] = min(low[cell], disc[child])
+            if not advanced:
+                stack.pop()
+                if stack:
+                    above = stack[-1][0]
+                    low[above] = min(low[above], low[cell])
+
+    def _findArticulationPoints(self, cells):
+        disc, low, parent, order = {}, {}, {}, []
+        points = set()
+        for root in cells:
+            if root in disc: continue
+            start = len(order)
+            self._depthFirst(root, disc, low, parent, order)
+            rootChildren = 0
+            for cell in order[start + 1:]:
+                above = parent[cell]
+                if above == root:
+                    rootChildren += 1
+                elif low[cell] >= disc[above]:
+                    points.add(above)
+            if rootChildren > 1:
+                points.add(root)
+        return points
+
+    def _findPockets(self, cells):
+        # Each connected part of the maze is searched from a cell of its biggest
+        # area free of articulation points, so that pockets hang off the main
+        # body of the maze rather than the other way around
+        areas = []
+        seen = set()
+        for cell in cells:
+            if cell in seen or cell in self.articulationPoints: continue
+            area = [cell]
+            seen.add(cell)
+            for current in area:
+                for next in self.neighbors[current]:
+                    if next not in seen and next not in self.articulationPoints:
+                        seen.add(next)
+                        area.append(next)
+            areas.append(area)
+        areas.sort(key=lambda area: -len(area))
+
+        disc, low, parent, order = {}, {}, {}, []
+        exits = {}
+        for area in areas:
+            root = area[0]
+            if root in disc: continue
+            start = len(order)
+            self._depthFirst(root, disc, low, parent, order)
+            for cell in order[start + 1:]:
+                above = parent[cell]
+                if above in exits:
+                    exits[cell] = exits[above]
+                elif above != root and low[cell] >= disc[above]:
+                    exits[cell] = above
+        return exits
+
+    def _measurePockets(self):
+        depths = {}
+        for exit, pocket in self.pockets.items():
+            inside = set(pocket)
+            depths[exit] = 0
+            frontier = [exit]
+            for cell in frontier:
+                for next in self.neighbors[cell]:
+                    if next in inside and next not in depths:
+                        depths[next] = depths[cell] + 1
+                        frontier.append(next)
+            del depths[exit]
+        return depths
+
+    def isArticulationPoint(self, pos):
+        return pos in self.articulationPoints
+
+    def getDeadEndDepth(self, pos):
+        return self.deadEndDepths.get(pos, 0)
+
+    def getPocketExit(self, pos):
+        "The exit of the pocket containing pos, or None if pos is in no pocket"
+        return self.pocketExits.get(pos)
+
+    def getPocket(self, pos):
+        "The cells behind the exit of the pocket containing pos (empty if none)"
+        exit = self.pocketExits.get(pos)
+        if exit == None: return ()
+        return self.pockets[exit]
+
+    def getBorderCrossings(self, isRed):
+        return self.borderCrossings[isRed]
+
 def getLayout(name, back = 2):
     if name.endswith('.lay'):
         layout = tryToLoad('layouts/' + name)
@@ -146,5 +346,17 @@ def getLayout(name, back = 2):
 def tryToLoad(fullname):
     if(not os.path.exists(fullname)): return None
     f = open(fullname)
-    try: return Layout([line.strip() for line in f])
+    try: return internLayout([line.strip() for line in f])
     finally: f.close()
+
+def internLayout(layoutText):
+    """
+    Returns the shared Layout for the text of a layout file, parsing the text
+    only the first time it is seen in this process.  Generated layouts should be
+    built with Layout directly, so that they are not kept for the life of the
+    process.
+    """
+    key = tuple(layoutText)
+    if key not in LAYOUT_CACHE:
+        LAYOUT_CACHE[key] = Layout(key, fromFile = True)
+    return LAYOUT_CACHE[key]
@@ -53,21 +53,6 @@ class BorderReflexAgent(ReflexCaptureAgent):
   Offense and Defense border agent: prioritizes easy food and easy defense near the borders.
   """
 
-  def registerInitialState(self, gameState):
-    super().registerInitialState(gameState)
-
-    width = gameState.data.layout.width
-    if self.red:
-      self.borderX = width // 2 - 1
-    else:
-      self.borderX = width // 2
-
-    self.border = []
-
-    for y in range(gameState.data.layout.height):
-      if not gameState.hasWall(self.borderX, y):
-        self.border.append((self.borderX, y))
-
   def isWinning(self, gameState):
     return self.getScore(gameState) > 0
   
@@ -101,8 +86,7 @@ class BorderReflexAgent(ReflexCaptureAgent):
 
     # If there are no invaders, go to the border
     if features['numInvaders'] == 0:
-      borderDists = [self.getMazeDistance(myPos, borderPos) for borderPos in self.border]
-      features['borderDistance'] = min(borderDists)
+      features['borderDistance'] = self.getDistanceToHome(myPos)
 
     if len(foodList) > 0:
         closestFood = min([self.getMazeDistance(myPos, f) for f in foodList])